@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2023 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+
+import database
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+FORMATS = ("jsonl", "csv")
+
+
+def format_from_path(path: str) -> str:
+    """
+    Guess the archive format from a file extension.
+
+    Args:
+        path (str): Archive filepath
+    Returns:
+        str: Either "jsonl" or "csv"
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension == "json":
+        return "jsonl"
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown archive format for {path}, use .jsonl or .csv")
+    return extension
+
+
+def read_rows(lines, archive_format: str):
+    """
+    Parse archive lines into (name, quote) tuples one row at a time. JSONL
+    rows are objects with "name" and "quote" keys, CSV files have a name,quote
+    header.
+
+    Args:
+        lines (iterable): Lines of the archive
+        archive_format (str): Either "jsonl" or "csv"
+    Yields:
+        tuple: (name, quote) tuples, quote is None for names without quotes
+    """
+    if archive_format == "csv":
+        for row in csv.DictReader(lines):
+            yield row.get("name"), row.get("quote") or None
+    else:
+        for line in lines:
+            if line.strip():
+                row = json.loads(line)
+                yield row.get("name"), row.get("quote")
+
+
+def write_rows(file, rows, archive_format: str) -> int:
+    """
+    Write (name, quote) tuples to a text file in the archive format.
+
+    Args:
+        file: Writable text file
+        rows (iterable): (name, quote) tuples
+        archive_format (str): Either "jsonl" or "csv"
+    Returns:
+        int: Number of rows written
+    """
+    count = 0
+    if archive_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(("name", "quote"))
+        for count, row in enumerate(rows, start=1):
+            writer.writerow("" if v is None else v for v in row)
+    else:
+        for count, (name, quote) in enumerate(rows, start=1):
+            file.write(json.dumps({"name": name, "quote": quote}, ensure_ascii=False))
+            file.write("\n")
+    return count
+
+
+def export_bytes(guild_id: int, archive_format: str) -> bytes:
+    """
+    Export the database of a guild into an in-memory archive, used for
+    uploading the archive to Discord.
+
+    Args:
+        guild_id (int): Guild to export
+        archive_format (str): Either "jsonl" or "csv"
+    Returns:
+        bytes: UTF-8 encoded archive
+    """
+    with io.StringIO(newline="") as file:
+        write_rows(file, database.export_quotes(guild_id), archive_format)
+        return file.getvalue().encode("utf-8")
+
+
+def import_bytes(
+    guild_id: int, data: bytes, archive_format: str, progress=None
+) -> tuple:
+    """
+    Import an archive uploaded to Discord into the database of a guild.
+
+    Args:
+        guild_id (int): Guild to import into
+        data (bytes): UTF-8 encoded archive
+        archive_format (str): Either "jsonl" or "csv"
+        progress (callable): Called with the number of rows processed after
+            every batch
+    Returns:
+        tuple: Number of names added, quotes added and duplicate quotes skipped
+    """
+    with io.StringIO(data.decode("utf-8-sig"), newline="") as file:
+        return database.import_quotes(
+            guild_id, read_rows(file, archive_format), progress=progress
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Import or export the quotes database as JSONL or CSV"
+    )
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("path", help="Archive file to read from or write to")
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to the extension")
+    parser.add_argument(
+        "--batch-size", type=int, default=10000, help="Rows per transaction"
+    )
+    parser.add_argument(
+        "--guild", type=int, default=0, help="Guild id, defaults to quotes.db"
+    )
+    parser.add_argument(
+        "--guilds-directory",
+        default=database.guilds_directory,
+        help="Directory holding the guild databases",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    archive_format = args.format or format_from_path(args.path)
+    database.configure(args.guilds_directory)
+
+    if args.action == "import":
+        with open(args.path, encoding="utf-8", newline="") as file:
+            names, quotes, duplicates = database.import_quotes(
+                args.guild,
+                read_rows(file, archive_format),
+                batch_size=args.batch_size,
+                progress=lambda count: module_logger.info(f"Imported {count} rows"),
+            )
+        module_logger.info(
+            f"Added {names} names and {quotes} quotes, skipped {duplicates} duplicates"
+        )
+    else:
+        with open(args.path, "w", encoding="utf-8", newline="") as file:
+            count = write_rows(file, database.export_quotes(args.guild), archive_format)
+        module_logger.info(f"Exported {count} rows to {args.path}")
+
+    database.close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import datetime
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import database
+import metrics
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def open_compressed(path: str, mode: str):
+    """
+    Open a backup file for binary reading or writing, compressed according
+    to its extension.
+
+    Args:
+        path (str): Backup filepath
+        mode (str): Either "rb" or "wb"
+    """
+    if path.endswith(".gz"):
+        import gzip
+
+        return gzip.open(path, mode)
+    if path.endswith(".zst"):
+        from compression import zstd
+
+        return zstd.open(path, mode)
+    return open(path, mode)
+
+
+def database_stem(path: str) -> str:
+    """Name backups of a database file start with, like "quotes" or a guild id."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def list_backups(directory: str, path: str) -> list:
+    """
+    Returns:
+        list: Backup filenames of a database in directory, newest first
+    """
+    if not os.path.isdir(directory):
+        return []
+    prefix = f"{database_stem(path)}-"
+    return sorted(
+        (
+            name
+            for name in os.listdir(directory)
+            if name.startswith(prefix) and ".db" in name and "partial" not in name
+        ),
+        reverse=True,
+    )
+
+
+def check_integrity(path: str) -> None:
+    """
+    Run PRAGMA integrity_check on an uncompressed database file.
+
+    Raises:
+        ValueError: The database is corrupt
+    """
+    conn = sqlite3.connect(
+        f"{pathlib.Path(path).absolute().as_uri()}?mode=ro", uri=True
+    )
+    try:
+        result = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"{path} is not a usable database: {e}") from e
+    finally:
+        conn.close()
+    if result != ["ok"]:
+        raise ValueError(f"{path} failed the integrity check: {'; '.join(result)}")
+
+
+def rotate(directory: str, path: str, keep: int) -> list:
+    """
+    Delete all but the newest backups of a database.
+
+    Args:
+        directory (str): Directory holding the backups
+        path (str): Database filepath the backups are of
+        keep (int): Number of backups to keep
+    Returns:
+        list: Filenames that were deleted
+    """
+    removed = list_backups(directory, path)[keep:]
+    for name in removed:
+        os.remove(os.path.join(directory, name))
+    if removed:
+        module_logger.info(f"Removed {len(removed)} old backups of {path}")
+    return removed
+
+
+def create_backup(
+    path: str, directory: str, compression: str = "gzip", keep: int = 7
+) -> str:
+    """
+    Snapshot a database into directory, check the snapshot's integrity,
+    compress it and delete backups beyond the newest keep. Blocks for the
+    whole backup, run it in a thread.
+
+    Args:
+        path (str): SQLite database filepath
+        directory (str): Directory to write the backup to
+        compression (str): One of "none", "gzip" or "zstd"
+        keep (int): Backups of the database to keep, 0 keeps all of them
+    Returns:
+        str: Filepath of the backup
+    Raises:
+        ValueError: The snapshot failed the integrity check
+    """
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.datetime.now(datetime.UTC)
+    name = f"{database_stem(path)}-{now:%Y%m%d-%H%M%S}.db"
+    snapshot = os.path.join(directory, f"{name}.partial")
+    destination = os.path.join(directory, name + COMPRESSIONS[compression])
+    try:
+        with metrics.timer("backup_seconds", stage="snapshot"):
+            database.snapshot_database(path, snapshot)
+        with metrics.timer("backup_seconds", stage="integrity_check"):
+            check_integrity(snapshot)
+        with (
+            metrics.timer("backup_seconds", stage="compress"),
+            open(snapshot, "rb") as source,
+            open_compressed(destination, "wb") as target,
+        ):
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    finally:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+    module_logger.info(f"Backed up {path} to {destination}")
+    if keep > 0:
+        rotate(directory, path, keep)
+    return destination
+
+
+def backup_guild(
+    guild_id: int, directory: str, compression: str = "gzip", keep: int = 7
+) -> str:
+    """
+    Back up a guild's database, creating it first if the guild has none yet.
+    Blocks for the whole backup, run it in a thread.
+
+    Returns:
+        str: Filepath of the backup
+    """
+    return create_backup(
+        database.get_guild(guild_id).path, directory, compression, keep
+    )
+
+
+def backup_all(directory: str, compression: str = "gzip", keep: int = 7) -> list:
+    """
+    Back up quotes.db and every guild database. A database that fails is
+    logged and skipped so it doesn't stop the others.
+
+    Returns:
+        list: Filepaths of the backups that were made
+    """
+    started = time.perf_counter()
+    backups = []
+    for path in database.database_files():
+        try:
+            backups.append(create_backup(path, directory, compression, keep))
+        except OSError, ValueError, sqlite3.Error:
+            module_logger.exception(f"Backup of {path} failed")
+    module_logger.info(
+        f"Made {len(backups)} backups in {time.perf_counter() - started:.2f}s"
+    )
+    return backups
+
+
+def restore_backup(guild_id: int, backup: str) -> None:
+    """
+    Decompress a backup next to it, check its integrity and restore it over
+    a guild's database.
+
+    Args:
+        guild_id (int): Guild whose database is replaced
+        backup (str): Backup filepath
+    Raises:
+        ValueError: The backup failed the integrity check
+    """
+    descriptor, snapshot = tempfile.mkstemp(
+        suffix=".db.partial", dir=os.path.dirname(os.path.abspath(backup))
+    )
+    try:
+        with (
+            os.fdopen(descriptor, "wb") as target,
+            open_compressed(backup, "rb") as source,
+        ):
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        check_integrity(snapshot)
+        database.restore_database(guild_id, snapshot)
+    finally:
+        os.remove(snapshot)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Back up the quotes databases or restore a backup"
+    )
+    parser.add_argument("action", choices=("backup", "restore", "list"))
+    parser.add_argument("backup", nargs="?", help="Backup file to restore")
+    parser.add_argument(
+        "--directory", default="backups", help="Directory holding the backups"
+    )
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip")
+    parser.add_argument(
+        "--keep", type=int, default=7, help="Backups kept per database, 0 keeps all"
+    )
+    parser.add_argument(
+        "--guild", type=int, default=0, help="Guild id, defaults to quotes.db"
+    )
+    parser.add_argument(
+        "--guilds-directory",
+        default=database.guilds_directory,
+        help="Directory holding the guild databases",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    database.configure(args.guilds_directory)
+
+    if args.action == "backup":
+        backup_all(args.directory, args.compression, args.keep)
+    elif args.action == "list":
+        for name in list_backups(args.directory, database.database_path(args.guild)):
+            print(name)
+    elif args.backup is None:
+        parser.error("restore needs the backup file to restore")
+    else:
+        restore_backup(args.guild, args.backup)
+
+    database.close_pools()
+
+
+if __name__ == "__main__":
+    main()
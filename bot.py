@@ -2,34 +2,41 @@
 # SPDX-FileCopyrightText: 2023 Kevin Patino
 # SPDX-License-Identifier: MIT
 
-import datetime
+import startup  # Times the imports below when STARTUP_PROFILE is set
+
+# isort: split
+
+import asyncio
+import atexit
 import logging
+import math
 import os
+import time
 
 import disnake
 from disnake.ext import commands
 
 import database
+import metrics
 from config import Config
-
-# Logging configuration
-log_format = "[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s"
-date_format = "%Y-%m-%d %H:%M:%S"
-logfilename = f"logs/bot_{datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S')!s}.log"
-logging.basicConfig(level=Config.log_level, format=log_format, datefmt=date_format)
+from logging_config import setup_logging
+from ratelimit import RateLimited, RateLimits
+
+startup.record("imports", time.perf_counter() - startup.started)
+
+# Logging configuration, records are written by a background thread
+log_listener = setup_logging(
+    Config.log_level,
+    json_format=Config.log_json,
+    max_bytes=Config.log_max_bytes,
+    backup_count=Config.log_backup_count,
+    when=Config.log_rotate_when,
+    debug_sample_rate=Config.log_debug_sample_rate,
+)
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 logger.setLevel(Config.log_level)
 
-try:
-    os.makedirs("logs", exist_ok=True)
-    logger.info("logs directory created successfully")
-except OSError:
-    logger.info("logs directory could not be created")
-
-handler = logging.FileHandler(filename=logfilename, encoding="utf-8", mode="w")
-handler.setFormatter(logging.Formatter(log_format, datefmt=date_format))
-logger.addHandler(handler)
-
 
 # Use prefixes from environment variable or use fallback
 # Will no longer be needed after switching to slash commands
@@ -46,8 +53,75 @@ def get_intents():
 class JamalBot(commands.Bot):
     def __init__(self) -> None:
         super().__init__(intents=get_intents(), command_prefix=get_prefix)
+        self.database_ready = None
+        self.ready_logged = False
+        self.rate_limits = RateLimits(Config.rate_limits)
+        self.add_check(self.rate_limit_check, call_once=True)
+        self.add_app_command_check(
+            self.app_rate_limit_check, call_once=True, slash_commands=True
+        )
+
+    def rate_limit_check(self, ctx: commands.Context) -> bool:
+        return self.rate_limits.check(ctx.command.qualified_name, ctx)
+
+    def app_rate_limit_check(
+        self, inter: disnake.ApplicationCommandInteraction
+    ) -> bool:
+        return self.rate_limits.check(inter.application_command.qualified_name, inter)
+
+    async def on_command_error(
+        self, ctx: commands.Context, error: commands.CommandError
+    ) -> None:
+        if isinstance(error, RateLimited):
+            await ctx.reply(
+                f"Slow down, try again in {math.ceil(error.retry_after)}s",
+                mention_author=False,
+            )
+            return
+        await super().on_command_error(ctx, error)
+
+    async def on_slash_command_error(
+        self, inter: disnake.ApplicationCommandInteraction, error: commands.CommandError
+    ) -> None:
+        if isinstance(error, RateLimited):
+            await inter.response.send_message(
+                f"Slow down, try again in {math.ceil(error.retry_after)}s",
+                ephemeral=True,
+            )
+            return
+        await super().on_slash_command_error(inter, error)
+
+    async def start(self, *args, **kwargs) -> None:
+        # Open and migrate the databases on the database threads while the
+        # gateway connection is being established
+        self.database_ready = asyncio.create_task(self.init_database())
+        await super().start(*args, **kwargs)
+
+    async def init_database(self) -> None:
+        started = time.perf_counter()
+        try:
+            await database.run_in_thread(database.migrate_databases)
+            await database.run_in_thread(database.sync_indexes)
+        except Exception:
+            logger.exception("Could not open the database, shutting down")
+            await self.close()
+            raise
+        startup.record("database", time.perf_counter() - started)
+
+    def load_extension(self, name: str, *, package: str | None = None) -> None:
+        started = time.perf_counter()
+        super().load_extension(name, package=package)
+        startup.record(f"cog {name}", time.perf_counter() - started)
 
     async def on_ready(self) -> None:
+        await self.database_ready
+        if not self.ready_logged:
+            self.ready_logged = True
+            elapsed = time.perf_counter() - startup.started
+            metrics.observe("startup_seconds", elapsed)
+            logger.info(f"Ready in {elapsed:.2f}s")
+            if startup.profiling:
+                logger.info(startup.report())
         logger.info(f"disnake version: {disnake.__version__}")
         logger.info(f"Logged in as: {bot.user} - {bot.user.id}")
         activity = disnake.Game(name=Config.discord_bot_activity)
@@ -55,15 +129,38 @@ class JamalBot(commands.Bot):
         # Logging done lets Pterodactyl know that it's ready
         logger.info("Done")
 
+    async def invoke(self, ctx: commands.Context) -> None:
+        name = ctx.command.qualified_name if ctx.command else "unknown"
+        with metrics.timer("command_latency_seconds", command=name, type="message"):
+            await super().invoke(ctx)
+
+    async def process_application_commands(
+        self, interaction: disnake.ApplicationCommandInteraction
+    ) -> None:
+        with metrics.timer(
+            "command_latency_seconds",
+            command=interaction.data.name,
+            type="application",
+        ):
+            await super().process_application_commands(interaction)
+
     def add_cog(self, cog: commands.Cog, *, override: bool = False) -> None:
         logger.info(f"Loading cog {cog.qualified_name}")
         return super().add_cog(cog, override=override)
 
 
 if __name__ == "__main__":
-    # Only creates the database if it doesn't exist
-    database.create_db("quotes.db")
+    # Existing databases are upgraded by init_database once the bot starts,
+    # guild databases that don't exist yet are created the first time a guild
+    # uses the bot
+    database.configure(
+        Config.database_directory,
+        Config.database_legacy_guild_id,
+        Config.database_max_open,
+    )
 
     bot = JamalBot()
     bot.load_extensions(os.path.join(Config.cogs_folder))
     bot.run(Config.discord_api_key)
+    database.flush_scores()
+    database.close_pools()
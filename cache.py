@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import logging
+import time
+
+import metrics
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+
+class AsyncTTLCache:
+    """
+    Cache for the results of coroutines keyed by an argument such as a server
+    address. Concurrent callers for the same key share one in-flight call.
+    Once an entry is older than ttl it is still served for stale_ttl more
+    seconds while it is refreshed in the background.
+
+    Args:
+        name (str): Name the cache is reported under in metrics
+        ttl (float): Seconds a result is considered fresh
+        stale_ttl (float): Seconds a result may be served while refreshing
+    """
+
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._in_flight = {}
+
+    async def get(self, key, factory):
+        """
+        Return the cached result for key, calling factory() to produce it if
+        there is no usable entry.
+
+        Args:
+            key: Cache key
+            factory (callable): Returns a coroutine producing the value
+        Returns:
+            The cached or freshly produced value
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            fresh_until, stale_until, value = entry
+            now = time.monotonic()
+            if now < fresh_until:
+                metrics.increment("cache_requests_total", cache=self.name, result="hit")
+                return value
+            if now < stale_until:
+                metrics.increment(
+                    "cache_requests_total", cache=self.name, result="stale"
+                )
+                self._refresh(key, factory)
+                return value
+        metrics.increment(
+            "cache_requests_total",
+            cache=self.name,
+            result="coalesced" if key in self._in_flight else "miss",
+        )
+        # Shield the shared task so one cancelled caller doesn't cancel it for all
+        return await asyncio.shield(self._refresh(key, factory))
+
+    def _refresh(self, key, factory) -> asyncio.Task:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, factory))
+            task.add_done_callback(self._log_failure)
+            self._in_flight[key] = task
+        return task
+
+    async def _fetch(self, key, factory):
+        try:
+            value = await factory()
+            now = time.monotonic()
+            self._entries[key] = (
+                now + self.ttl,
+                now + self.ttl + self.stale_ttl,
+                value,
+            )
+            return value
+        finally:
+            del self._in_flight[key]
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        # Retrieve the exception so background refreshes don't warn when they fail
+        if not task.cancelled() and task.exception() is not None:
+            module_logger.debug(f"Cache refresh failed: {task.exception()!r}")
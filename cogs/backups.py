@@ -0,0 +1,221 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import logging
+import os
+import sqlite3
+
+import disnake
+from disnake.ext import commands, tasks
+
+import backup
+import database
+from cogs.quotes import guild_key
+from config import Config
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+
+class BackupCommands(commands.Cog):
+    def __init__(self, bot):
+        self.bot: commands.Bot = bot
+        if Config.backup_compression not in backup.COMPRESSIONS:
+            raise ValueError(
+                f"Unknown BACKUP_COMPRESSION {Config.backup_compression}, "
+                f"use one of {', '.join(backup.COMPRESSIONS)}"
+            )
+        # Only one backup or restore runs at a time
+        self.lock = asyncio.Lock()
+        if Config.backup_interval_hours > 0:
+            self.backup_loop.change_interval(hours=Config.backup_interval_hours)
+            self.backup_loop.start()
+
+    def cog_unload(self) -> None:
+        self.backup_loop.cancel()
+
+    @tasks.loop(hours=24.0)
+    async def backup_loop(self) -> None:
+        # Backups run on their own thread so the database workers stay free
+        # for commands
+        async with self.lock:
+            await asyncio.to_thread(
+                backup.backup_all,
+                Config.backup_directory,
+                Config.backup_compression,
+                Config.backup_keep,
+            )
+
+    @backup_loop.before_loop
+    async def before_backup_loop(self) -> None:
+        await self.bot.wait_until_ready()
+
+    async def backup_command(self, guild_id: int) -> str:
+        """
+        Back up a guild's database now.
+
+        Args:
+            guild_id (int): Guild whose database is backed up
+        Returns:
+            str: Message with status information
+        """
+        async with self.lock:
+            try:
+                path = await asyncio.to_thread(
+                    backup.backup_guild,
+                    guild_id,
+                    Config.backup_directory,
+                    Config.backup_compression,
+                    Config.backup_keep,
+                )
+            except (OSError, ValueError, sqlite3.Error) as e:
+                module_logger.exception("Backup failed")
+                return f"Backup failed: {e}"
+        return f"Backed up to {os.path.basename(path)}"
+
+    async def list_command(self, guild_id: int) -> str:
+        """
+        List a guild's backups, newest first.
+
+        Args:
+            guild_id (int): Guild whose backups are listed
+        Returns:
+            str: Message with the backup filenames
+        """
+        names = await asyncio.to_thread(
+            backup.list_backups,
+            Config.backup_directory,
+            database.database_path(guild_id),
+        )
+        return "\n".join(names) or "No backups yet"
+
+    async def restore_command(self, guild_id: int, name: str) -> str:
+        """
+        Restore one of a guild's backups over its database. The current
+        database is backed up first so the restore can be undone.
+
+        Args:
+            guild_id (int): Guild whose database is replaced
+            name (str): Backup filename from the backup list
+        Returns:
+            str: Message with status information
+        """
+        path = database.database_path(guild_id)
+        names = await asyncio.to_thread(
+            backup.list_backups, Config.backup_directory, path
+        )
+        if name not in names:
+            return f"There is no backup named {name}"
+        async with self.lock:
+            try:
+                undo = await asyncio.to_thread(
+                    backup.backup_guild,
+                    guild_id,
+                    Config.backup_directory,
+                    Config.backup_compression,
+                    0,
+                )
+                await asyncio.to_thread(
+                    backup.restore_backup,
+                    guild_id,
+                    os.path.join(Config.backup_directory, name),
+                )
+            except (OSError, ValueError, sqlite3.Error) as e:
+                module_logger.exception(f"Restore of {name} failed")
+                return f"Restore failed: {e}"
+        return f"Restored {name}, the previous database is {os.path.basename(undo)}"
+
+    async def autocomplete_backups(
+        self, inter: disnake.CommandInteraction, user_input: str
+    ) -> list:
+        # Runs on every keystroke, keep the directory listing off the loop
+        names = await asyncio.to_thread(
+            backup.list_backups,
+            Config.backup_directory,
+            database.database_path(guild_key(inter)),
+        )
+        return [name for name in names if user_input in name][:25]
+
+    @commands.group(
+        name="backup", description="Back up or restore this server's database"
+    )
+    async def backup_group(self, ctx) -> None:
+        if ctx.invoked_subcommand is None:
+            await ctx.reply("Missing required argument", mention_author=False)
+
+    @backup_group.command(name="now", description="Back up this server's database now")
+    @commands.has_role(Config.discord_admin_role_id)
+    async def backup_now(self, ctx) -> None:
+        module_logger.info(f'Message command "backup now" executed by {ctx.author.id}')
+        await ctx.reply(await self.backup_command(guild_key(ctx)), mention_author=False)
+
+    @backup_group.command(name="list", description="List this server's backups")
+    @commands.has_role(Config.discord_admin_role_id)
+    async def backup_list(self, ctx) -> None:
+        module_logger.info(f'Message command "backup list" executed by {ctx.author.id}')
+        await ctx.reply(await self.list_command(guild_key(ctx)), mention_author=False)
+
+    @backup_group.command(name="restore", description="Restore a backup of this server")
+    @commands.has_role(Config.discord_admin_role_id)
+    async def backup_restore(self, ctx, name: str) -> None:
+        module_logger.info(
+            f'Message command "backup restore" with input: [{name}] executed by {ctx.author.id}'
+        )
+        await ctx.reply(
+            await self.restore_command(guild_key(ctx), name), mention_author=False
+        )
+
+    @commands.slash_command(
+        name="backup", description="Back up or restore this server's database"
+    )
+    async def slash_backup(self, inter: disnake.CommandInteraction) -> None:
+        pass
+
+    @slash_backup.sub_command(
+        name="now", description="Back up this server's database now"
+    )
+    @commands.has_role(Config.discord_admin_role_id)
+    async def slash_backup_now(self, inter: disnake.CommandInteraction) -> None:
+        module_logger.info(f'Slash command "backup now" executed by {inter.author.id}')
+        await inter.response.defer()
+        await inter.edit_original_response(
+            content=await self.backup_command(guild_key(inter))
+        )
+
+    @slash_backup.sub_command(name="list", description="List this server's backups")
+    @commands.has_role(Config.discord_admin_role_id)
+    async def slash_backup_list(self, inter: disnake.CommandInteraction) -> None:
+        module_logger.info(f'Slash command "backup list" executed by {inter.author.id}')
+        await inter.response.defer()
+        await inter.edit_original_response(
+            content=await self.list_command(guild_key(inter))
+        )
+
+    @slash_backup.sub_command(
+        name="restore",
+        description="Restore a backup of this server",
+        options=[
+            disnake.Option("name", description="Backup to restore", required=True)
+        ],
+    )
+    @commands.has_role(Config.discord_admin_role_id)
+    async def slash_backup_restore(
+        self, inter: disnake.CommandInteraction, name: str
+    ) -> None:
+        module_logger.info(
+            f'Slash command "backup restore" with input: [{name}] executed by {inter.author.id}'
+        )
+        await inter.response.defer()
+        await inter.edit_original_response(
+            content=await self.restore_command(guild_key(inter), name)
+        )
+
+    @slash_backup_restore.autocomplete("name")
+    async def slash_backup_restore_autocomp(
+        self, inter: disnake.CommandInteraction, user_input: str
+    ) -> list:
+        return await self.autocomplete_backups(inter, user_input)
+
+
+def setup(bot) -> None:
+    bot.add_cog(BackupCommands(bot))
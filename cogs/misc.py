@@ -1,35 +1,69 @@
 # SPDX-FileCopyrightText: 2023 Kevin Patino
 # SPDX-License-Identifier: MIT
 
+import datetime
 import logging
-from datetime import datetime
+import time
+import zoneinfo
 
 import disnake
-import pytz
 from disnake.ext import commands
 
+import database
 from config import Config
 
 module_logger = logging.getLogger(f"__main__.{__name__}")
 
+# Discord embeds can't have more fields than this
+MAX_TIMEZONES = 25
 
-async def timezone_embed() -> disnake.Embed:
+
+def validate_timezones(names: list) -> list:
+    """
+    Check that every name is a timezone zoneinfo knows. ZoneInfo caches the
+    zones it loads, so later lookups of the same names are free.
+
+    Args:
+        names (list): Timezone names like "Europe/London"
+    Returns:
+        list: The names with whitespace and duplicates removed
+    Raises:
+        ValueError: A name is not a known timezone or there are too many
     """
-    Create an embed with the current time in different timezones and return it.
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    if len(names) > MAX_TIMEZONES:
+        raise ValueError(f"At most {MAX_TIMEZONES} timezones can be listed")
+    unknown = []
+    for name in names:
+        try:
+            zoneinfo.ZoneInfo(name)
+        except zoneinfo.ZoneInfoNotFoundError, ValueError:
+            unknown.append(name)
+    if unknown:
+        raise ValueError(f"Unknown timezones: {', '.join(unknown)}")
+    return names
+
+
+def timezone_embed(timezones: tuple, now: datetime.datetime) -> disnake.Embed:
+    """
+    Create an embed with the time in different timezones and return it.
 
+    Args:
+        timezones (tuple): Timezone names
+        now (datetime): Aware datetime to show
     Returns
         embed: Time in different timezones
     """
 
     embed = disnake.Embed(title="Time")
 
-    if Config.timezone_list:
-        module_logger.debug(f"Using the following timezones: {Config.timezone_list}")
+    if timezones:
+        module_logger.debug(f"Using the following timezones: {timezones}")
         embed.set_default_colour(disnake.Colour.purple())
-        for tz in Config.timezone_list:
+        for tz in timezones:
             embed.add_field(
                 name=tz,
-                value=datetime.now(pytz.timezone(tz)).strftime(
+                value=now.astimezone(zoneinfo.ZoneInfo(tz)).strftime(
                     "%b %d %I:%M %p (%H:%M)"
                 ),
                 inline=False,
@@ -46,23 +80,164 @@ async def timezone_embed() -> disnake.Embed:
     return embed
 
 
+class TimezoneEmbeds:
+    """
+    Time embeds shared by every caller, keyed by timezone list. The embeds
+    only show minutes, so they are all dropped and rebuilt on demand once the
+    minute changes.
+    """
+
+    def __init__(self):
+        self.minute = None
+        self.embeds = {}
+
+    def get(self, timezones: tuple) -> disnake.Embed:
+        minute = int(time.time() // 60)
+        if minute != self.minute:
+            self.minute = minute
+            self.embeds = {}
+        embed = self.embeds.get(timezones)
+        if embed is None:
+            now = datetime.datetime.fromtimestamp(minute * 60, datetime.UTC)
+            embed = self.embeds[timezones] = timezone_embed(timezones, now)
+        return embed
+
+
+async def save_timezones_command(guild_id: int, user_id: int, names: str) -> str:
+    """
+    Validate and save a comma separated timezone list for a guild or user.
+
+    Args:
+        guild_id (int): Guild the list is for
+        user_id (int): User the list is for, 0 for the guild's list
+        names (str): Comma separated timezone names, empty to clear the list
+
+    Returns:
+        str: Message with status information
+    """
+    try:
+        timezones = validate_timezones(names.split(","))
+    except ValueError as e:
+        return str(e)
+    await database.async_set_timezones(guild_id, user_id, timezones)
+    owner = "Your" if user_id else "This server's"
+    if not timezones:
+        return f"{owner} timezones were cleared"
+    return f"{owner} timezones are now {', '.join(timezones)}"
+
+
 class MiscCommands(commands.Cog):
     def __init__(self, bot):
         self.bot: commands.Bot = bot
+        # Fail loading the cog on a misspelled timezone instead of on /time
+        self.default_timezones = tuple(validate_timezones(Config.timezone_list))
+        self.embeds = TimezoneEmbeds()
+
+    async def timezones_for(self, source) -> tuple:
+        """
+        Returns the timezones to show someone, their own list if they saved
+        one, otherwise the server's list and finally the configured default.
+
+        Args:
+            source : Pass either ctx or inter
+        """
+        timezones = await database.async_get_timezones(0, source.author.id)
+        if not timezones and source.guild is not None:
+            timezones = await database.async_get_timezones(source.guild.id)
+        return tuple(timezones) or self.default_timezones
 
     @commands.command(
         name="time", description="Get the current time in different timezones"
     )
     async def time(self, ctx) -> None:
         module_logger.info(f'Message command "time" executed by {ctx.author.id}')
-        await ctx.reply(embed=await timezone_embed(), mention_author=False)
+        embed = self.embeds.get(await self.timezones_for(ctx))
+        await ctx.reply(embed=embed, mention_author=False)
 
     @commands.slash_command(
         name="time", description="Get the current time in different timezones"
     )
     async def slash_time(self, inter: disnake.CommandInteraction) -> None:
         module_logger.info(f'Slash command "time" executed by {inter.author.id}')
-        await inter.response.send_message(embed=await timezone_embed())
+        embed = self.embeds.get(await self.timezones_for(inter))
+        await inter.response.send_message(embed=embed)
+
+    @commands.group(description="Set the timezones shown by the time command")
+    async def timezones(self, ctx) -> None:
+        if ctx.invoked_subcommand is None:
+            await ctx.reply("Missing required argument", mention_author=False)
+
+    @timezones.command(name="me", description="Set your own timezones")
+    async def timezones_me(self, ctx, *, names: str = "") -> None:
+        module_logger.info(
+            f'Message command "timezones me" with input: [{names}] executed by {ctx.author.id}'
+        )
+        await ctx.reply(
+            await save_timezones_command(0, ctx.author.id, names),
+            mention_author=False,
+        )
+
+    @timezones.command(name="server", description="Set this server's timezones")
+    @commands.guild_only()
+    @commands.has_any_role(Config.discord_admin_role_id, Config.discord_mod_role_id)
+    async def timezones_server(self, ctx, *, names: str = "") -> None:
+        module_logger.info(
+            f'Message command "timezones server" with input: [{names}] executed by {ctx.author.id}'
+        )
+        await ctx.reply(
+            await save_timezones_command(ctx.guild.id, 0, names),
+            mention_author=False,
+        )
+
+    @commands.slash_command(
+        name="timezones", description="Set the timezones shown by the time command"
+    )
+    async def slash_timezones(self, inter: disnake.CommandInteraction) -> None:
+        pass
+
+    @slash_timezones.sub_command(
+        name="me",
+        description="Set your own timezones",
+        options=[
+            disnake.Option(
+                "names",
+                description="Comma separated timezones like Europe/London, "
+                "leave empty to clear",
+            )
+        ],
+    )
+    async def slash_timezones_me(
+        self, inter: disnake.CommandInteraction, names: str = ""
+    ) -> None:
+        module_logger.info(
+            f'Slash command "timezones me" with input: [{names}] executed by {inter.author.id}'
+        )
+        await inter.response.send_message(
+            await save_timezones_command(0, inter.author.id, names), ephemeral=True
+        )
+
+    @slash_timezones.sub_command(
+        name="server",
+        description="Set this server's timezones",
+        options=[
+            disnake.Option(
+                "names",
+                description="Comma separated timezones like Europe/London, "
+                "leave empty to clear",
+            )
+        ],
+    )
+    @commands.guild_only()
+    @commands.has_any_role(Config.discord_admin_role_id, Config.discord_mod_role_id)
+    async def slash_timezones_server(
+        self, inter: disnake.CommandInteraction, names: str = ""
+    ) -> None:
+        module_logger.info(
+            f'Slash command "timezones server" with input: [{names}] executed by {inter.author.id}'
+        )
+        await inter.response.send_message(
+            await save_timezones_command(inter.guild_id, 0, names)
+        )
 
 
 def setup(bot) -> None:
@@ -2,40 +2,65 @@
 # SPDX-License-Identifier: MIT
 
 import asyncio
+import functools
+import io
 import logging
+import time
 
 import disnake
 from disnake.ext import commands, tasks
 
+import archive
 import database
 from config import Config
+from game import GameEngine, GuessResult
 
 module_logger = logging.getLogger(f"__main__.{__name__}")
 
 
-def access_command(name: str) -> str:
+def guild_key(source) -> int:
     """
-    Returns a random quote from the database by name.
+    Returns the id of the guild whose database a command uses.
+
+    Args:
+        source : Pass either ctx or inter
+
+    Returns:
+        int: Guild id, 0 in direct messages
+    """
+    return source.guild.id if source.guild else 0
+
+
+async def access_command(guild_id: int, channel_id: int, name: str) -> str:
+    """
+    Returns a random quote from the database by name, without repeating one
+    in the channel until all of them have been shown.
     If there are no quotes return a string saying so.
 
     Args:
+        guild_id (int): Guild whose database is used
+        channel_id (int): Channel the quote is shown in
         name (str): Name in the database with quotes
 
     Returns:
         str: Message with status information
     """
     name = name.lower()
-    if database.verify_name(name) is True:
-        return database.get_random_quote(name)
-    else:
+    found, quote = await database.async_get_random_quote(guild_id, name, channel_id)
+    if not found:
         return f'The name "{name}" is not in the database'
+    elif quote is None:
+        return f"{name} does not have any quotes"
+    else:
+        return quote
 
 
-def add_name_command(author, name: str) -> str:
+async def add_name_command(guild_id: int, author, name: str) -> str:
     """
     Name to add to the database.
 
     Args:
+        guild_id (int): Guild whose database is used
         author : Pass either ctx.message.author.mention or inter.author.mention
         name (str): User provided name to add to the database
 
@@ -43,19 +68,19 @@ def add_name_command(author, name: str) -> str:
         str: Message with status information
     """
     name = name.lower()
-    if database.verify_name(name) is True:
-        return f'The name "{name}" is already in the database'
-    else:
-        database.add_name(name)
+    if await database.async_add_name(guild_id, name):
         return f'{author} added "{name}" to the database'
+    else:
+        return f'The name "{name}" is already in the database'
 
 
-def add_quote_command(name: str, quote: str) -> str:
+async def add_quote_command(guild_id: int, name: str, quote: str) -> str:
     """
     Add a quote to the database attributed to a name
     Return message with information on whether it was successful.
 
     Args:
+        guild_id (int): Guild whose database is used
         name (str): Name for quote attribution
         quote (str): The quote in a string value
 
@@ -63,61 +88,203 @@ def add_quote_command(name: str, quote: str) -> str:
         str: Message with status information
     """
     name = name.lower()
-    if database.verify_name(name) is False:
-        return f'The name "{name}" is not in the database'
+    if quote == "":
+        return "A quote was not provided"
+
+    result = await database.async_add_quote(guild_id, name, quote)
+    if result is database.AddQuoteResult.ADDED:
+        return f"Added “{quote}” to {name}"
+    elif result is database.AddQuoteResult.DUPLICATE:
+        return f"{name} already has that quote"
+    elif result is database.AddQuoteResult.SIMILAR:
+        return f"{name} already has a quote very similar to that"
     else:
-        if quote == "":
-            return "A quote was not provided"
-        else:
-            database.add_quote(name, quote)
-            return f"Added “{quote}” to {name}"
+        return f'The name "{name}" is not in the database'
 
 
-def remove_name_command(author, name: str) -> str:
+async def remove_name_command(guild_id: int, author, name: str) -> str:
     """
     Removes name and the associated quotes from the database. Cannot be undone.
 
     Args:
+        guild_id (int): Guild whose database is used
         author : Pass either ctx.message.author.mention or inter.author.mention
         name (str): Name to remove from the database
     Returns:
         str: Message with status
     """
     name = name.lower()
-    if database.verify_name(name) is False:
-        return f'"{name}" is not in the database'
-    else:
-        database.remove_name(name)
+    if await database.async_remove_name(guild_id, name):
         return f'{author} removed "{name}" from the database'
+    else:
+        return f'"{name}" is not in the database'
+
+
+async def search_embed(guild_id: int, query: str, page: int = 1) -> disnake.Embed:
+    """
+    Returns a disnake embed with a page of quotes matching the search query,
+    best matches first.
+
+    Args:
+        guild_id (int): Guild whose quotes are searched
+        query (str): Words to search for in the quotes
+        page (int): Page of results to show
+
+    Returns:
+        embed: Matching quotes with the matching words highlighted
+    """
+    per_page = 10
+    page = max(page, 1)
+    total, results = await database.async_search_quotes(guild_id, query, page, per_page)
+    pages = max(-(-total // per_page), 1)
+
+    if total == 0:
+        return disnake.Embed(
+            title=f"Search: {query}",
+            description="No quotes found",
+            colour=disnake.Colour.red(),
+        )
+
+    embed = disnake.Embed(title=f"Search: {query}", colour=disnake.Colour.blue())
+    if not results:
+        embed.description = f"Page {page} is out of range"
+    for name, snippet in results:
+        embed.add_field(name=name, value=f"“{snippet}”", inline=False)
+    embed.set_footer(text=f"Page {page}/{pages} · {total} quotes")
+    return embed
+
+
+async def leaderboard_embed(guild_id: int) -> disnake.Embed:
+    """
+    Returns a disnake embed ranking the users with the most correct guesses
+    in the guessing game.
+
+    Args:
+        guild_id (int): Guild to rank
+
+    Returns:
+        embed: Top 10 users with their correct and total guesses
+    """
+    leaderboard = await database.async_get_leaderboard(guild_id)
+    embed = disnake.Embed(title="Leaderboard", colour=disnake.Colour.gold())
+    embed.description = (
+        "\n".join(
+            f"{rank}. <@{user_id}> {correct} correct out of {correct + wrong} guesses"
+            for rank, (user_id, correct, wrong) in enumerate(leaderboard, start=1)
+        )
+        or "Nobody has guessed a quote yet"
+    )
+    return embed
+
+
+class NamesPaginator(disnake.ui.View):
+    """
+    Button driven view over the names in a guild's database. Only the page
+    being shown is loaded, the names on its edges are used as cursors for the
+    previous and next pages.
+    """
+
+    per_page = 20
+
+    def __init__(self, guild_id: int):
+        super().__init__(timeout=180)
+        self.guild_id = guild_id
+        self.message = None
+        self.rows = []
+        self.has_previous = False
+        self.has_next = False
+
+    async def load(self, after: str | None = None, before: str | None = None):
+        self.rows, has_more = await database.async_get_names_page(
+            self.guild_id, after, before, self.per_page
+        )
+        if before is not None:
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = after is not None, has_more
+        self.previous_page.disabled = not self.has_previous
+        self.next_page.disabled = not self.has_next
+
+    def embed(self) -> disnake.Embed:
+        embed = disnake.Embed(title="Names", colour=disnake.Colour.blue())
+        if self.rows:
+            embed.description = "\n".join(
+                f"{name} ({count} {'quote' if count == 1 else 'quotes'})"
+                for name, count in self.rows
+            )
+        else:
+            embed.description = "There are no names in the database"
+        return embed
+
+    @disnake.ui.button(label="Previous", style=disnake.ButtonStyle.secondary)
+    async def previous_page(
+        self, button: disnake.ui.Button, inter: disnake.MessageInteraction
+    ) -> None:
+        await self.load(before=self.rows[0][0] if self.rows else None)
+        await inter.response.edit_message(embed=self.embed(), view=self)
+
+    @disnake.ui.button(label="Next", style=disnake.ButtonStyle.secondary)
+    async def next_page(
+        self, button: disnake.ui.Button, inter: disnake.MessageInteraction
+    ) -> None:
+        await self.load(after=self.rows[-1][0] if self.rows else None)
+        await inter.response.edit_message(embed=self.embed(), view=self)
+
+    async def on_timeout(self) -> None:
+        if self.message is not None:
+            await self.message.edit(view=None)
 
 
 class QuotesCommands(commands.Cog):
     def __init__(self, bot):
         self.bot: commands.Bot = bot
-        self.names_list = ""
-        self.retrieve_names_loop.start()
+        self.game_engine = GameEngine()
+        self.flush_scores_loop.start()
+
+    def cog_unload(self) -> None:
+        # after_flush_scores writes what is left once the loop has stopped
+        self.flush_scores_loop.cancel()
 
-    @commands.contexts(bot_dm=False)
-    @tasks.loop(seconds=15.0)
-    async def retrieve_names_loop(self) -> None:
-        self.names_list = database.get_names_list()
+    @tasks.loop(seconds=5.0)
+    async def flush_scores_loop(self) -> None:
+        await database.async_flush_scores()
+
+    @flush_scores_loop.after_loop
+    async def after_flush_scores(self) -> None:
+        await database.async_flush_scores()
+
+    async def autocomplete_names(
+        self, inter: disnake.CommandInteraction, user_input: str
+    ) -> list:
+        name_index = await database.async_get_name_index(guild_key(inter))
+        return name_index.search(user_input, limit=25)
 
     @commands.command(name="list", description="List available names from the database")
     async def list_names(self, ctx) -> None:
         module_logger.info(f'Message command "list" executed by {ctx.author.id}')
-        await ctx.reply(database.get_names(), mention_author=False)
+        paginator = NamesPaginator(guild_key(ctx))
+        await paginator.load()
+        paginator.message = await ctx.reply(
+            embed=paginator.embed(), view=paginator, mention_author=False
+        )
 
     @commands.slash_command(
         name="list", description="List available names from the database"
     )
     async def slash_list_names(self, inter: disnake.CommandInteraction) -> None:
         module_logger.info(f'Slash command "list" executed by {inter.author.id}')
-        await inter.response.send_message(database.get_names())
+        paginator = NamesPaginator(guild_key(inter))
+        await paginator.load()
+        await inter.response.send_message(embed=paginator.embed(), view=paginator)
+        paginator.message = await inter.original_response()
 
     @commands.command(description="Access a random quote by name")
     async def access(self, ctx, input_name: str) -> None:
         module_logger.info(f'Message command "access" executed by {ctx.author.id}')
-        await ctx.reply(access_command(input_name), mention_author=False)
+        await ctx.reply(
+            await access_command(guild_key(ctx), ctx.channel.id, input_name),
+            mention_author=False,
+        )
 
     @commands.slash_command(
         name="access",
@@ -132,14 +299,15 @@ class QuotesCommands(commands.Cog):
     )
     async def slash_access(self, inter: disnake.CommandInteraction, name: str) -> None:
         module_logger.info(f'Slash command "access" executed by {inter.author.id}')
-        await inter.response.send_message(access_command(name))
+        await inter.response.send_message(
+            await access_command(guild_key(inter), inter.channel_id, name)
+        )
 
     @slash_access.autocomplete("name")
     async def slash_access_autocomp(
         self, inter: disnake.CommandInteraction, user_input: str
     ):
-        user_input = user_input.lower()
-        return [name for name in self.names_list if user_input in name.lower()]
+        return await self.autocomplete_names(inter, user_input)
 
     @commands.group(name="add", description="Add a name or quote to the database")
     async def add(self, ctx) -> None:
@@ -153,7 +321,9 @@ class QuotesCommands(commands.Cog):
             f'Message command "add name" with input: [{input_name}] executed by {ctx.author.id}'
         )
         await ctx.reply(
-            add_name_command(ctx.message.author.mention, input_name),
+            await add_name_command(
+                guild_key(ctx), ctx.message.author.mention, input_name
+            ),
             mention_author=False,
         )
 
@@ -162,7 +332,10 @@ class QuotesCommands(commands.Cog):
         module_logger.info(
             f'Message command "add quote" with inputs: [{input_name}] [{arg}] executed by {ctx.author.id}'
         )
-        await ctx.reply(add_quote_command(input_name, arg), mention_author=False)
+        await ctx.reply(
+            await add_quote_command(guild_key(ctx), input_name, arg),
+            mention_author=False,
+        )
 
     @commands.slash_command(
         name="add", description="Add a name or quote to the database"
@@ -185,7 +358,9 @@ class QuotesCommands(commands.Cog):
         module_logger.info(
             f'Message command "add name" with input: [{name}] executed by {inter.author.id}'
         )
-        await inter.response.send_message(add_name_command(inter.author.mention, name))
+        await inter.response.send_message(
+            await add_name_command(guild_key(inter), inter.author.mention, name)
+        )
 
     @slash_add.sub_command(
         name="quote",
@@ -207,14 +382,15 @@ class QuotesCommands(commands.Cog):
         module_logger.info(
             f'Slash command "add quote" with inputs: [{name}] [{quote}] executed by {inter.author.id}'
         )
-        await inter.response.send_message(add_quote_command(name, quote))
+        await inter.response.send_message(
+            await add_quote_command(guild_key(inter), name, quote)
+        )
 
     @slash_add_quote.autocomplete("name")
     async def slash_add_quote_autocomp(
         self, inter: disnake.CommandInteraction, string: str
     ):
-        string = string.lower()
-        return [name for name in self.names_list if string in name.lower()]
+        return await self.autocomplete_names(inter, string)
 
     @commands.group(description="Remove a name and their quotes from the database")
     async def remove(self, ctx) -> None:
@@ -230,7 +406,9 @@ class QuotesCommands(commands.Cog):
             f'Message command "remove name" with inputs: [{input_name}] executed by {ctx.author.id}'
         )
         await ctx.reply(
-            remove_name_command(ctx.message.author.mention, input_name),
+            await remove_name_command(
+                guild_key(ctx), ctx.message.author.mention, input_name
+            ),
             mention_author=False,
         )
 
@@ -248,57 +426,242 @@ class QuotesCommands(commands.Cog):
             f'Slash command "remove name" with inputs: [{name}] executed by {inter.author.id}'
         )
         await inter.response.send_message(
-            remove_name_command(inter.author.mention, name)
+            await remove_name_command(guild_key(inter), inter.author.mention, name)
         )
 
     @slash_remove_name.autocomplete("name")
     async def slash_remove_name_autocomp(
         self, inter: disnake.CommandInteraction, string: str
     ):
-        string = string.lower()
-        return [name for name in self.names_list if string in name.lower()]
+        return await self.autocomplete_names(inter, string)
 
-    @commands.command(description="Get a random quote and guess who said it")
-    async def quotes(self, ctx) -> None:
-        module_logger.info(f'Message command "quotes" executed by {ctx.author.id}')
-        name = database.get_random_name()
+    @commands.command(description="Search quotes by their content")
+    async def search(self, ctx, *, query: str) -> None:
+        module_logger.info(f'Message command "search" executed by {ctx.author.id}')
         await ctx.reply(
-            f"Who said “{database.get_random_quote(name)}”", mention_author=False
+            embed=await search_embed(guild_key(ctx), query), mention_author=False
         )
 
+    @commands.slash_command(
+        name="search",
+        description="Search quotes by their content",
+        options=[
+            disnake.Option("query", description="Words to search for", required=True),
+            disnake.Option(
+                "page",
+                description="Page of results to show",
+                type=disnake.OptionType.integer,
+                min_value=1,
+            ),
+        ],
+    )
+    async def slash_search(
+        self, inter: disnake.CommandInteraction, query: str, page: int = 1
+    ) -> None:
+        module_logger.info(f'Slash command "search" executed by {inter.author.id}')
+        await inter.response.send_message(
+            embed=await search_embed(guild_key(inter), query, page)
+        )
+
+    @commands.slash_command(
+        name="archive", description="Import or export this server's quotes"
+    )
+    async def slash_archive(self, inter: disnake.CommandInteraction) -> None:
+        pass
+
+    @slash_archive.sub_command(
+        name="export",
+        description="Export every name and quote as a file",
+        options=[
+            disnake.Option(
+                "format",
+                description="Archive format, JSONL by default",
+                choices=list(archive.FORMATS),
+            )
+        ],
+    )
+    @commands.has_role(Config.discord_admin_role_id)
+    async def slash_archive_export(
+        self, inter: disnake.CommandInteraction, format: str = "jsonl"
+    ) -> None:
+        module_logger.info(
+            f'Slash command "archive export" executed by {inter.author.id}'
+        )
+        await inter.response.defer()
+        data = await database.run_in_guild_thread(
+            archive.export_bytes, guild_key(inter), format
+        )
+        await inter.followup.send(
+            file=disnake.File(io.BytesIO(data), filename=f"quotes.{format}")
+        )
+
+    @slash_archive.sub_command(
+        name="import",
+        description="Import names and quotes from a JSONL or CSV file",
+        options=[
+            disnake.Option(
+                "file",
+                description="JSONL or CSV archive",
+                type=disnake.OptionType.attachment,
+                required=True,
+            )
+        ],
+    )
+    @commands.has_role(Config.discord_admin_role_id)
+    async def slash_archive_import(
+        self, inter: disnake.CommandInteraction, file: disnake.Attachment
+    ) -> None:
+        module_logger.info(
+            f'Slash command "archive import" with input: [{file.filename}] executed by {inter.author.id}'
+        )
         try:
-            guess = await ctx.bot.wait_for("message", timeout=6.0)
+            archive_format = archive.format_from_path(file.filename)
+        except ValueError as e:
+            await inter.response.send_message(str(e))
+            return
+        await inter.response.defer()
+
+        loop = asyncio.get_running_loop()
+        last_update = time.monotonic()
+
+        def progress(count: int) -> None:
+            # Runs on the database thread, throttle edits to avoid rate limits
+            nonlocal last_update
+            if time.monotonic() - last_update > 2:
+                last_update = time.monotonic()
+                asyncio.run_coroutine_threadsafe(
+                    inter.edit_original_response(content=f"Imported {count} rows…"),
+                    loop,
+                )
+
+        try:
+            names, quotes, duplicates = await database.run_in_guild_thread(
+                archive.import_bytes,
+                guild_key(inter),
+                await file.read(),
+                archive_format,
+                progress,
+            )
+        except (AttributeError, TypeError, ValueError, UnicodeDecodeError) as e:
+            module_logger.warning(f"Import of {file.filename} failed: {e}")
+            await inter.edit_original_response(content=f"Import failed: {e}")
+            return
+        await inter.edit_original_response(
+            content=f"{inter.author.mention} added {names} names and {quotes} quotes, "
+            f"skipped {duplicates} duplicates"
+        )
+
+    async def play_round(self, guild_id: int, channel, ask) -> None:
+        """
+        Play a round of the guessing game in a channel. Guesses are routed to
+        the round by on_message.
+
+        Args:
+            guild_id (int): Guild whose quotes are used
+            channel: Channel the round is played in
+            ask (callable): Sends the question, ctx.reply or
+                inter.response.send_message
+        """
+        name = await database.async_get_random_name(
+            guild_id, Config.game_weighted_names
+        )
+        game = self.game_engine.start(channel.id, name, Config.game_max_guesses)
+        if game is None:
+            await ask("A game is already running in this channel")
+            return
 
-            if guess.content.lower() == name:
-                await ctx.channel.send(f"You got em <@{guess.author.id}>")
+        try:
+            _, quote = await database.async_get_random_quote(guild_id, name, channel.id)
+            await ask(f"Who said “{quote or f'{name} does not have any quotes'}”")
+            if not await game.wait(Config.game_timeout):
+                await channel.send(f"YOU TOOK TO LONG it was {name}")
+            elif game.winner is not None:
+                await channel.send(f"You got em <@{game.winner}>")
             else:
-                await ctx.channel.send(
-                    f"<@{guess.author.id}> YOU'RE WRONG‼IT WAS {name.upper()}‼"
+                await channel.send(
+                    f"<@{game.last_guesser}> YOU'RE WRONG‼ IT WAS {name.upper()}‼"
                 )
-        except TimeoutError:
-            return await ctx.channel.send(f"TOOK TO LONG it was {name}")
+        finally:
+            self.game_engine.end(channel.id)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: disnake.Message) -> None:
+        # Commands like the one that started the round are not guesses
+        if message.author.bot or message.content.startswith(
+            tuple(Config.discord_bot_prefixes)
+        ):
+            return
+        result = self.game_engine.guess(
+            message.channel.id, message.author.id, message.content
+        )
+        if result is None:
+            return
+        database.record_guess(
+            guild_key(message),
+            message.author.id,
+            result is GuessResult.CORRECT,
+        )
+        if result is GuessResult.WRONG:
+            await message.add_reaction("❌")
+
+    @commands.command(description="Get a random quote and guess who said it")
+    async def quotes(self, ctx) -> None:
+        module_logger.info(f'Message command "quotes" executed by {ctx.author.id}')
+        await self.play_round(
+            guild_key(ctx),
+            ctx.channel,
+            functools.partial(ctx.reply, mention_author=False),
+        )
 
     @commands.slash_command(
         name="quotes", description="Get a random quote and guess who said it"
     )
     async def slash_quotes(self, inter: disnake.CommandInteraction) -> None:
         module_logger.info(f'Slash command "quotes" executed by {inter.author.id}')
-        name = database.get_random_name()
-        await inter.response.send_message(
-            f"Who said “{database.get_random_quote(name)}”"
+        await self.play_round(
+            guild_key(inter), inter.channel, inter.response.send_message
         )
 
-        try:
-            guess = await inter.bot.wait_for("message", timeout=6.0)
+    @commands.command(description="Show who guessed the most quotes in this channel")
+    async def scores(self, ctx) -> None:
+        module_logger.info(f'Message command "scores" executed by {ctx.author.id}')
+        await ctx.reply(embed=self.scores_embed(ctx.channel.id), mention_author=False)
 
-            if guess.content.lower() == name:
-                await inter.channel.send(f"You got em <@{guess.author.id}>")
-            else:
-                await inter.channel.send(
-                    f"<@{guess.author.id}> YOU'RE WRONG‼ IT WAS {name.upper()}‼"
-                )
-        except TimeoutError:
-            await inter.channel.send(f"YOU TOOK TO LONG it was {name}")
+    @commands.slash_command(
+        name="scores", description="Show who guessed the most quotes in this channel"
+    )
+    async def slash_scores(self, inter: disnake.CommandInteraction) -> None:
+        module_logger.info(f'Slash command "scores" executed by {inter.author.id}')
+        await inter.response.send_message(embed=self.scores_embed(inter.channel.id))
+
+    @commands.command(description="Show the best quote guessers in this server")
+    async def leaderboard(self, ctx) -> None:
+        module_logger.info(f'Message command "leaderboard" executed by {ctx.author.id}')
+        await ctx.reply(
+            embed=await leaderboard_embed(guild_key(ctx)),
+            mention_author=False,
+        )
+
+    @commands.slash_command(
+        name="leaderboard", description="Show the best quote guessers in this server"
+    )
+    async def slash_leaderboard(self, inter: disnake.CommandInteraction) -> None:
+        module_logger.info(f'Slash command "leaderboard" executed by {inter.author.id}')
+        await inter.response.send_message(
+            embed=await leaderboard_embed(guild_key(inter))
+        )
+
+    def scores_embed(self, channel_id: int) -> disnake.Embed:
+        scoreboard = self.game_engine.scoreboard(channel_id)
+        embed = disnake.Embed(title="Scores", colour=disnake.Colour.gold())
+        embed.description = (
+            "\n".join(
+                f"{rank}. <@{user_id}> {score}"
+                for rank, (user_id, score) in enumerate(scoreboard, start=1)
+            )
+            or "Nobody has guessed a quote here yet"
+        )
+        return embed
 
 
 def setup(bot) -> None:
@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import logging
+
+import disnake
+from disnake.ext import commands
+
+import metrics
+from config import Config
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds == float("inf"):
+        return f">{metrics.DEFAULT_BUCKETS[-1]:g} s"
+    if seconds < 1:
+        return f"{seconds * 1000:g} ms"
+    return f"{seconds:g} s"
+
+
+def histogram_lines(name: str, label: str, limit: int = 10) -> str:
+    """
+    Summarize the busiest histograms under a metric name, one line each with
+    the count and estimated p50/p99.
+    """
+    series = sorted(
+        metrics.histograms(name).items(),
+        key=lambda item: item[1].count,
+        reverse=True,
+    )
+    lines = []
+    for key, histogram in series[:limit]:
+        labels = dict(key)
+        lines.append(
+            f"`{labels.get(label, '?')}` ×{histogram.count} · "
+            f"p50 {format_seconds(histogram.quantile(0.5))} · "
+            f"p99 {format_seconds(histogram.quantile(0.99))}"
+        )
+    return "\n".join(lines) or "No data yet"
+
+
+def cache_lines() -> str:
+    caches = {}
+    for key, count in metrics.counters("cache_requests_total").items():
+        labels = dict(key)
+        caches.setdefault(labels["cache"], {})[labels["result"]] = count
+    lines = []
+    for cache, results in sorted(caches.items()):
+        total = sum(results.values())
+        hits = total - results.get("miss", 0)
+        lines.append(f"`{cache}` {100 * hits / total:.1f}% hits of {int(total)}")
+    return "\n".join(lines) or "No data yet"
+
+
+def stats_embed() -> disnake.Embed:
+    """
+    Create an embed summarizing the metrics recorded since the bot started.
+
+    Returns:
+        embed: Command, database, status probe, event loop and cache metrics
+    """
+    embed = disnake.Embed(title="Stats", colour=disnake.Colour.blurple())
+    embed.add_field(
+        name="Commands",
+        value=histogram_lines("command_latency_seconds", "command"),
+        inline=False,
+    )
+    embed.add_field(
+        name="Database",
+        value=histogram_lines("database_query_seconds", "function"),
+        inline=False,
+    )
+    embed.add_field(
+        name="Status probes",
+        value=histogram_lines("status_probe_seconds", "stage"),
+        inline=False,
+    )
+    lag = metrics.histograms("event_loop_lag_seconds").get(())
+    embed.add_field(
+        name="Event loop lag",
+        value=(
+            f"p50 {format_seconds(lag.quantile(0.5))} · "
+            f"p99 {format_seconds(lag.quantile(0.99))}"
+            if lag
+            else "No data yet"
+        ),
+        inline=False,
+    )
+    embed.add_field(name="Caches", value=cache_lines(), inline=False)
+    return embed
+
+
+class StatsCommands(commands.Cog):
+    def __init__(self, bot):
+        self.bot: commands.Bot = bot
+        self.lag_monitor = None
+        self.metrics_runner = None
+
+    async def cog_load(self) -> None:
+        self.lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+        if Config.metrics_port:
+            self.metrics_runner = await metrics.start_http_server(
+                Config.metrics_host, Config.metrics_port
+            )
+
+    def cog_unload(self) -> None:
+        if self.lag_monitor is not None:
+            self.lag_monitor.cancel()
+        if self.metrics_runner is not None:
+            asyncio.create_task(self.metrics_runner.cleanup())
+
+    @commands.command(name="stats", description="Show bot performance metrics")
+    @commands.has_role(Config.discord_admin_role_id)
+    async def stats(self, ctx) -> None:
+        module_logger.info(f'Message command "stats" executed by {ctx.author.id}')
+        await ctx.reply(embed=stats_embed(), mention_author=False)
+
+    @commands.slash_command(name="stats", description="Show bot performance metrics")
+    @commands.has_role(Config.discord_admin_role_id)
+    async def slash_stats(self, inter: disnake.CommandInteraction) -> None:
+        module_logger.info(f'Slash command "stats" executed by {inter.author.id}')
+        await inter.response.send_message(embed=stats_embed(), ephemeral=True)
+
+
+def setup(bot) -> None:
+    bot.add_cog(StatsCommands(bot))
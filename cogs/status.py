@@ -2,46 +2,97 @@
 # SPDX-FileCopyrightText: 2023 py-mine
 # SPDX-License-Identifier: Apache-2.0 AND MIT
 
+from __future__ import annotations
+
 import asyncio
+import collections
+import datetime
 import logging
+import time
+from typing import TYPE_CHECKING
 
 import disnake
-from disnake.ext import commands
-from mcstatus import JavaServer
-from mcstatus.responses import JavaStatusResponse, QueryResponse
+from disnake.ext import commands, tasks
 
+import metrics
+from cache import AsyncTTLCache
 from config import Config
 
+# mcstatus is imported by the functions that need it so that loading the cog
+# doesn't pay for it, the first status command or monitor probe does
+if TYPE_CHECKING:
+    from mcstatus import JavaServer
+    from mcstatus.responses import JavaStatusResponse, QueryResponse
+
 module_logger = logging.getLogger(f"__main__.{__name__}")
 
+# Resolved servers (SRV/DNS lookups) and status results keyed by address
+lookup_cache = AsyncTTLCache("lookup", ttl=300)
+status_cache = AsyncTTLCache(
+    "status", ttl=Config.status_cache_ttl, stale_ttl=Config.status_cache_stale_ttl
+)
+# Caps how many servers are contacted at once across every command and the
+# monitor, so a burst of commands can't open an unbounded number of sockets
+status_semaphore = asyncio.Semaphore(Config.status_concurrency)
+
+
+async def lookup(host: str) -> JavaServer:
+    """
+    Resolve a server address, reusing recent lookups of the same address.
+    """
+    from mcstatus import JavaServer
+
+    return await lookup_cache.get(host, lambda: JavaServer.async_lookup(host))
+
 
 async def status(host: str) -> JavaStatusResponse | QueryResponse:
     """
     Get status from server, which can be a normal status or GameSpy4 query
 
-    The function will ping server for status and query in one time, and will try to prefer the query.
+    The status and query are requested at the same time and the first
+    successful response wins. The query is preferred since it includes the
+    player list, so a status that arrives first waits up to
+    Config.status_query_preference milliseconds for the query to finish.
+    Whichever request loses is cancelled.
     """
-    success_task = await handle_exceptions(
-        *(
-            await asyncio.wait(
-                {
-                    asyncio.create_task(
-                        handle_java_query(host), name="Get query as Java"
-                    ),
-                    asyncio.create_task(
-                        handle_java_status(host), name="Get status as Java"
-                    ),
-                },
-                return_when=asyncio.FIRST_COMPLETED,
-                timeout=10,
-            )
-        )
+    started = time.perf_counter()
+    query_task = asyncio.create_task(handle_java_query(host), name="Get query as Java")
+    status_task = asyncio.create_task(
+        handle_java_status(host), name="Get status as Java"
     )
-
-    if success_task is None:
-        raise ValueError("No tasks were successful. Is the server offline?")
-
-    return success_task.result()
+    pending = {query_task, status_task}
+    try:
+        async with asyncio.timeout(10):
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                if query_task in done and query_task.exception() is None:
+                    winner = query_task
+                    break
+                if status_task in done and status_task.exception() is None:
+                    winner = status_task
+                    if query_task in pending:
+                        await asyncio.wait(
+                            {query_task},
+                            timeout=Config.status_query_preference / 1000,
+                        )
+                        if query_task.done() and query_task.exception() is None:
+                            winner = query_task
+                    break
+            else:
+                raise ValueError("No tasks were successful. Is the server offline?")
+    except TimeoutError as e:
+        raise ValueError("Timed out waiting for the server. Is it offline?") from e
+    finally:
+        query_task.cancel()
+        status_task.cancel()
+
+    module_logger.debug(
+        f"{winner.get_name()} won for {host} after "
+        f"{(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+    return winner.result()
 
 
 async def latency(host: str) -> float:
@@ -49,51 +100,10 @@ async def latency(host: str) -> float:
     Get latency from server
     """
     module_logger.info(f"Pinging server at {host}")
-    success_task = await handle_exceptions(
-        *(
-            await asyncio.wait(
-                {
-                    asyncio.create_task(
-                        handle_latency(host), name="Get server latency"
-                    ),
-                },
-                return_when=asyncio.FIRST_COMPLETED,
-            )
-        )
-    )
-
-    if success_task is None:
-        raise ValueError(f"Failed to ping server at {host}")
-
-    return success_task.result()
-
-
-async def handle_exceptions(
-    done: set[asyncio.Task], pending: set[asyncio.Task]
-) -> asyncio.Task | None:
-    """
-    Handle exceptions from tasks.
-
-    Also, cancel all pending tasks, if found correct one.
-    """
-    if len(done) == 0:
-        raise ValueError("No tasks was given to `done` set.")
-
-    for i, task in enumerate(done):
-        if task.exception() is not None:
-            if len(pending) == 0:
-                continue
-
-            if (
-                i == len(done) - 1
-            ):  # firstly check all items from `done` set, and then handle pending set
-                return await handle_exceptions(
-                    *(await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION))
-                )
-        else:
-            for pending_task in pending:
-                pending_task.cancel()
-            return task
+    try:
+        return await handle_latency(host)
+    except Exception as e:
+        raise ValueError(f"Failed to ping server at {host}") from e
 
 
 async def handle_java_status(host: str) -> JavaStatusResponse | None:
@@ -101,9 +111,11 @@ async def handle_java_status(host: str) -> JavaStatusResponse | None:
     try:
         async with asyncio.timeout(6):
             module_logger.info(f"Fetching Java server status at {host}")
-            status = await (await JavaServer.async_lookup(host)).async_status()
-            module_logger.debug("Yielding to Java query")
-            await asyncio.sleep(1)
+            started = time.perf_counter()
+            server = await lookup(host)
+            looked_up = time.perf_counter()
+            status = await server.async_status()
+            log_stage_timing("status", host, started, looked_up)
             return status
     except TimeoutError:
         module_logger.warning("Timed out, something went wrong. Is the server down?")
@@ -121,7 +133,12 @@ async def handle_java_query(host: str) -> QueryResponse | None:
     try:
         module_logger.info(f"Fetching Java server query at {host}")
         async with asyncio.timeout(4):
-            return await (await JavaServer.async_lookup(host)).async_query()
+            started = time.perf_counter()
+            server = await lookup(host)
+            looked_up = time.perf_counter()
+            query = await server.async_query()
+            log_stage_timing("query", host, started, looked_up)
+            return query
     except TimeoutError:
         module_logger.warning(
             "Query timed out, does the server have enable-query=false?"
@@ -139,99 +156,331 @@ async def handle_java_query(host: str) -> QueryResponse | None:
 
 async def handle_latency(host: str) -> float:
     """A wrapper around mcstatus, to compress it in one function."""
-    return await (await JavaServer.async_lookup(host)).async_ping()
+    started = time.perf_counter()
+    server = await lookup(host)
+    looked_up = time.perf_counter()
+    server_latency = await server.async_ping()
+    log_stage_timing("ping", host, started, looked_up)
+    return server_latency
+
+
+def log_stage_timing(stage: str, host: str, started: float, looked_up: float) -> None:
+    finished = time.perf_counter()
+    metrics.observe("status_probe_seconds", looked_up - started, stage="lookup")
+    metrics.observe("status_probe_seconds", finished - looked_up, stage=stage)
+    module_logger.debug(
+        f"Java {stage} at {host} took {(finished - started) * 1000:.0f} ms "
+        f"(lookup {(looked_up - started) * 1000:.0f} ms, "
+        f"{stage} {(finished - looked_up) * 1000:.0f} ms)"
+    )
 
 
-async def status_embed(server_address: str) -> disnake.Embed:
+async def fetch_status(
+    host: str,
+) -> tuple[JavaStatusResponse | QueryResponse, float]:
     """
-    Returns a disnake embed containing the status of a Minecraft server at the
-    provided address
+    Get the status of a server along with its latency in milliseconds. Waits
+    for a slot under the shared probe concurrency limit first.
+    """
+    from mcstatus.responses import QueryResponse
+
+    async with status_semaphore:
+        server_status = await status(host)
+        if isinstance(server_status, QueryResponse):
+            # Query doesn't provide latency
+            return server_status, await latency(host)
+        return server_status, server_status.latency
+
+
+async def cached_status(host: str) -> tuple[JavaStatusResponse | QueryResponse, float]:
+    """
+    Same as fetch_status, but concurrent and repeated calls for the same
+    address within the cache TTL share a single set of network requests.
+    """
+    key = host.strip().lower()
+    return await status_cache.get(key, lambda: fetch_status(host))
+
+
+def build_status_embed(
+    server_address: str,
+    server_status: JavaStatusResponse | QueryResponse,
+    server_latency: float,
+) -> disnake.Embed:
+    """
+    Returns a disnake embed built from a status or query response
 
     Args:
         server_address (str): Server address or IP
+        server_status: Response from the server
+        server_latency (float): Latency to the server in milliseconds
     Returns:
         embed: Server status information
     """
+    from mcstatus.responses import JavaStatusResponse, QueryResponse
+
+    if isinstance(server_status, QueryResponse):
+        module_logger.debug("Creating Discord embed with QueryResponse")
+        server_status_embed = disnake.Embed(
+            title=server_address,
+            description=f"{server_status.software.brand} {server_status.software.version}",
+            colour=disnake.Colour.green(),
+        )
+        server_status_embed.add_field(
+            name="Description",
+            value=f"```ansi\n\u200b{server_status.motd.to_ansi()}```",
+            inline=False,
+        )
+        server_status_embed.add_field(
+            name="Count",
+            value=f"{server_status.players.online}/{server_status.players.max}",
+            inline=True,
+        )
+        server_players = ", ".join(server_status.players.list)
+        server_status_embed.add_field(
+            name="Players",
+            value=f"\u200b{server_players}",  # Unicode blank prevents an empty "value"
+            inline=True,
+        )
+        server_status_embed.set_footer(text=f"Ping: {int(server_latency)} ms")
+        return server_status_embed
+
+    elif isinstance(server_status, JavaStatusResponse):
+        module_logger.warning(
+            "Creating Discord embed with JavaStatusResponse, did QueryResponse fail?"
+        )
+        server_status_embed = disnake.Embed(
+            title=server_address,
+            description=server_status.version.name,
+            colour=disnake.Colour.green(),
+        )
+        server_status_embed.add_field(
+            name="Description",
+            value=f"```ansi\n\u200b{server_status.motd.to_ansi()}```",  # Unicode blank prevents an empty "value"
+            inline=False,
+        )
+        server_status_embed.add_field(
+            name="Count",
+            value=f"{server_status.players.online}/{server_status.players.max}",
+            inline=True,
+        )
+        server_status_embed.set_footer(text=f"Ping: {int(server_latency)} ms")
+        return server_status_embed
+
+    else:
+        raise TypeError
 
-    error_embed = disnake.Embed(
+
+def build_error_embed(server_address: str) -> disnake.Embed:
+    return disnake.Embed(
         title=server_address,
         description="Could not contact server",
         colour=disnake.Colour.red(),
     )
-    try:
-        server_status = await status(server_address)
-
-        if isinstance(server_status, QueryResponse):
-            module_logger.debug("Creating Discord embed with QueryResponse")
-            server_latency = await latency(
-                server_address
-            )  # Query doesn't provide latency
-            server_status_embed = disnake.Embed(
-                title=server_address,
-                description=f"{server_status.software.brand} {server_status.software.version}",
-                colour=disnake.Colour.green(),
-            )
-            server_status_embed.add_field(
-                name="Description",
-                value=f"```ansi\n\u200b{server_status.motd.to_ansi()}```",
-                inline=False,
-            )
-            server_status_embed.add_field(
-                name="Count",
-                value=f"{server_status.players.online}/{server_status.players.max}",
-                inline=True,
-            )
-            server_players = ", ".join(server_status.players.list)
-            server_status_embed.add_field(
-                name="Players",
-                value=f"\u200b{server_players}",  # Unicode blank prevents an empty "value"
-                inline=True,
-            )
-            server_status_embed.set_footer(text=f"Ping: {int(server_latency)} ms")
-            return server_status_embed
 
-        elif isinstance(server_status, JavaStatusResponse):
-            module_logger.warning(
-                "Creating Discord embed with JavaStatusResponse, did QueryResponse fail?"
-            )
-            server_status_embed = disnake.Embed(
-                title=server_address,
-                description=server_status.version.name,
-                colour=disnake.Colour.green(),
-            )
-            server_status_embed.add_field(
-                name="Description",
-                value=f"```ansi\n\u200b{server_status.motd.to_ansi()}```",  # Unicode blank prevents an empty "value"
-                inline=False,
-            )
-            server_status_embed.add_field(
-                name="Count",
-                value=f"{server_status.players.online}/{server_status.players.max}",
-                inline=True,
-            )
-            server_status_embed.set_footer(
-                text=f"Ping: {int(server_status.latency)} ms"
-            )
-            return server_status_embed
 
-        else:
-            raise TypeError
+async def status_embed(server_address: str) -> disnake.Embed:
+    """
+    Returns a disnake embed containing the status of a Minecraft server at the
+    provided address
 
+    Args:
+        server_address (str): Server address or IP
+    Returns:
+        embed: Server status information
+    """
+    try:
+        server_status, server_latency = await cached_status(server_address)
+        return build_status_embed(server_address, server_status, server_latency)
     except (asyncio.exceptions.TimeoutError, TypeError, ValueError) as e:
         module_logger.error(e)
         module_logger.warning(f"Could not lookup server at {server_address}")
-        return error_embed
+        return build_error_embed(server_address)
+
+
+async def bounded_status(
+    host: str,
+) -> tuple[JavaStatusResponse | QueryResponse, float] | None:
+    """
+    Get the cached status of a server, limited by the per-server deadline.
+    Returns None if the server could not be reached in time.
+    """
+    try:
+        async with asyncio.timeout(Config.status_deadline):
+            return await cached_status(host)
+    except (TimeoutError, TypeError, ValueError) as e:
+        module_logger.warning(f"Could not lookup server at {host}: {e}")
+        return None
+
+
+async def multi_status_embed(server_addresses: list) -> disnake.Embed:
+    """
+    Returns a disnake embed summarizing several Minecraft servers. The servers
+    are contacted concurrently so this takes as long as the slowest server.
+
+    Args:
+        server_addresses (list): Server addresses or IPs
+    Returns:
+        embed: One field per server
+    """
+    from mcstatus.responses import QueryResponse
+
+    results = await asyncio.gather(
+        *(bounded_status(address) for address in server_addresses)
+    )
+    online = sum(result is not None for result in results)
+    embed = disnake.Embed(
+        title="Servers",
+        description=f"{online}/{len(server_addresses)} online",
+        colour=disnake.Colour.green() if online else disnake.Colour.red(),
+    )
+    for address, result in zip(server_addresses, results, strict=True):
+        if result is None:
+            embed.add_field(
+                name=address, value="Could not contact server", inline=False
+            )
+            continue
+        server_status, server_latency = result
+        if isinstance(server_status, QueryResponse):
+            version = f"{server_status.software.brand} {server_status.software.version}"
+        else:
+            version = server_status.version.name
+        embed.add_field(
+            name=address,
+            value=f"{version} · {server_status.players.online}/"
+            f"{server_status.players.max} players · {int(server_latency)} ms",
+            inline=False,
+        )
+    return embed
+
+
+class MonitoredServer:
+    """
+    Last known state of a server polled by the status monitor along with a
+    pre-built embed that /status can send without contacting the server.
+    """
+
+    def __init__(self, address: str, history_size: int):
+        self.address = address
+        self.online = None
+        self.status = None
+        self.latency = None
+        self.last_checked = None
+        self.last_online = None
+        self.history = collections.deque(maxlen=history_size)
+        self.embed = None
+
+    def uptime(self) -> float | None:
+        if not self.history:
+            return None
+        return 100 * sum(self.history) / len(self.history)
+
+    def update(
+        self,
+        server_status: JavaStatusResponse | QueryResponse | None,
+        server_latency: float | None,
+    ) -> bool:
+        """
+        Record the result of a probe and rebuild the embed.
+
+        Returns:
+            bool: True if the server went up or down since the last probe
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        online = server_status is not None
+        changed = self.online is not None and self.online != online
+        self.online = online
+        self.last_checked = now
+        self.history.append(online)
+        if online:
+            self.status = server_status
+            self.latency = server_latency
+            self.last_online = now
+            self.embed = build_status_embed(self.address, server_status, server_latency)
+        else:
+            self.embed = build_error_embed(self.address)
+            if self.last_online is not None:
+                self.embed.add_field(
+                    name="Last seen online",
+                    value=disnake.utils.format_dt(self.last_online, "R"),
+                    inline=False,
+                )
+        uptime = self.uptime()
+        self.embed.add_field(name="Uptime", value=f"{uptime:.1f}%", inline=True)
+        self.embed.timestamp = now
+        return changed
 
 
 class StatusCommands(commands.Cog):
     def __init__(self, bot):
         self.bot: commands.Bot = bot
+        self.monitored = {
+            address.strip().lower(): MonitoredServer(
+                address, Config.status_history_size
+            )
+            for address in [
+                Config.default_server_address,
+                *Config.status_watch_list,
+            ]
+        }
+        if Config.status_monitor_interval > 0:
+            self.monitor_loop.change_interval(seconds=Config.status_monitor_interval)
+            self.monitor_loop.start()
+
+    def cog_unload(self) -> None:
+        self.monitor_loop.cancel()
+
+    @tasks.loop(seconds=60.0)
+    async def monitor_loop(self) -> None:
+        await asyncio.gather(
+            *(self.probe(server) for server in self.monitored.values())
+        )
+
+    @monitor_loop.before_loop
+    async def before_monitor_loop(self) -> None:
+        await self.bot.wait_until_ready()
+
+    async def probe(self, server: MonitoredServer) -> None:
+        try:
+            server_status, server_latency = await fetch_status(server.address)
+        except (TimeoutError, TypeError, ValueError) as e:
+            module_logger.debug(f"Monitor could not reach {server.address}: {e}")
+            server_status, server_latency = None, None
+        if server.update(server_status, server_latency):
+            state = "online" if server.online else "offline"
+            module_logger.warning(f"{server.address} is now {state}")
+            await self.notify(f"{server.address} is now {state}", server.embed)
+
+    async def notify(self, message: str, embed: disnake.Embed) -> None:
+        if Config.status_notify_channel_id is None:
+            return
+        channel = self.bot.get_channel(Config.status_notify_channel_id)
+        if channel is None:
+            module_logger.warning(
+                f"Status notification channel {Config.status_notify_channel_id} not found"
+            )
+            return
+        await channel.send(message, embed=embed)
+
+    def server_addresses(self) -> list:
+        return [server.address for server in self.monitored.values()]
+
+    async def get_status_embed(self, server_address: str) -> disnake.Embed:
+        """
+        Serve the pre-built embed if the server is monitored and has been
+        probed, otherwise contact the server.
+        """
+        server = self.monitored.get(server_address.strip().lower())
+        if server is not None and server.embed is not None:
+            return server.embed
+        return await status_embed(server_address)
 
     @commands.command(description="Get the status of a Minecraft server.")
     async def status(self, ctx, server_address=Config.default_server_address) -> None:
         module_logger.info(f'Message command "status" executed by {ctx.author.id}')
         await ctx.trigger_typing()
-        await ctx.reply(embed=await status_embed(server_address), mention_author=False)
+        await ctx.reply(
+            embed=await self.get_status_embed(server_address), mention_author=False
+        )
 
     @commands.slash_command(
         name="status",
@@ -250,7 +499,30 @@ class StatusCommands(commands.Cog):
     ) -> None:
         module_logger.info(f'Slash command "status" executed by {inter.author.id}')
         await inter.response.defer(with_message=True)
-        await inter.followup.send(embed=await status_embed(server_address))
+        await inter.followup.send(embed=await self.get_status_embed(server_address))
+
+    @commands.command(
+        name="statusall", description="Get the status of every configured server."
+    )
+    async def status_all(self, ctx) -> None:
+        module_logger.info(f'Message command "statusall" executed by {ctx.author.id}')
+        await ctx.trigger_typing()
+        await ctx.reply(
+            embed=await multi_status_embed(self.server_addresses()),
+            mention_author=False,
+        )
+
+    @commands.slash_command(
+        name="status-all", description="Get the status of every configured server."
+    )
+    async def slash_status_all(
+        self, inter: disnake.ApplicationCommandInteraction
+    ) -> None:
+        module_logger.info(f'Slash command "status-all" executed by {inter.author.id}')
+        await inter.response.defer(with_message=True)
+        await inter.followup.send(
+            embed=await multi_status_embed(self.server_addresses())
+        )
 
 
 def setup(bot) -> None:
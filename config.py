@@ -8,12 +8,42 @@ class Config:
     env = Env()
     env.read_env()
 
+    backup_compression = env.str("BACKUP_COMPRESSION", "gzip")
+    backup_directory = env.str("BACKUP_DIRECTORY", "./backups")
+    backup_interval_hours = env.float("BACKUP_INTERVAL_HOURS", 24)
+    backup_keep = env.int("BACKUP_KEEP", 7)
     cogs_folder = env.str("COGS_FOLDER", "./cogs/")
     discord_admin_role_id = env.int("DISCORD_ADMIN_ROLE_ID")
     discord_api_key = env("DISCORD_API_KEY")
     discord_mod_role_id = env.int("DISCORD_MOD_ROLE_ID")
     discord_bot_activity = env.str("DISCORD_BOT_ACTIVITY", "Warframe")
     discord_bot_prefixes = env.list("DISCORD_BOT_PREFIXES", ".")
+    database_directory = env.str("DATABASE_DIRECTORY", "./guilds")
+    database_legacy_guild_id = env.int("DATABASE_LEGACY_GUILD_ID", 0)
+    database_max_open = env.int("DATABASE_MAX_OPEN", 32)
+    game_max_guesses = env.int("GAME_MAX_GUESSES", 3)
+    game_timeout = env.float("GAME_TIMEOUT", 6.0)
+    game_weighted_names = env.bool("GAME_WEIGHTED_NAMES", True)
     default_server_address = env("DEFAULT_SERVER_ADDRESS")
+    log_backup_count = env.int("LOG_BACKUP_COUNT", 14)
+    log_debug_sample_rate = env.float("LOG_DEBUG_SAMPLE_RATE", 1.0)
+    log_json = env.bool("LOG_JSON", False)
     log_level = env.log_level("LOG_LEVEL", "INFO")
-    timezone_list = env.list("TIMEZONE_LIST", "Europe/London,US/Pacific")
+    log_max_bytes = env.int("LOG_MAX_BYTES", 10_000_000)
+    log_rotate_when = env.str("LOG_ROTATE_WHEN", "midnight")
+    metrics_host = env.str("METRICS_HOST", "127.0.0.1")
+    metrics_port = env.int("METRICS_PORT", 0)
+    rate_limits = env.dict(
+        "RATE_LIMITS",
+        {"quotes.channel": "3/30", "status.user": "3/30", "statusall.user": "1/30"},
+    )
+    status_cache_ttl = env.float("STATUS_CACHE_TTL", 30)
+    status_cache_stale_ttl = env.float("STATUS_CACHE_STALE_TTL", 60)
+    status_concurrency = env.int("STATUS_CONCURRENCY", 8)
+    status_deadline = env.float("STATUS_DEADLINE", 5)
+    status_history_size = env.int("STATUS_HISTORY_SIZE", 1440)
+    status_monitor_interval = env.float("STATUS_MONITOR_INTERVAL", 60)
+    status_query_preference = env.int("STATUS_QUERY_PREFERENCE_MS", 250)
+    status_notify_channel_id = env.int("STATUS_NOTIFY_CHANNEL_ID", None)
+    status_watch_list = env.list("STATUS_WATCH_LIST", [])
+    timezone_list = env.list("TIMEZONE_LIST", ["Europe/London", "US/Pacific"])
@@ -1,201 +1,1245 @@
 # SPDX-FileCopyrightText: 2023 Kevin Patino
 # SPDX-License-Identifier: MIT
 
+import asyncio
+import collections
+import enum
+import itertools
 import logging
-import random
+import os
+import pathlib
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import migrations
+from indexes import NameIndex, NearDuplicateIndex, QuoteIndex, quote_hash
 
 module_logger = logging.getLogger(f"__main__.{__name__}")
 
+READ_CONNECTIONS = 4
+
+# All blocking sqlite3 work is funneled through these workers so that command
+# handlers never touch the disk from the event loop. One worker per read
+# connection plus one for the writer.
+_executor = ThreadPoolExecutor(
+    max_workers=READ_CONNECTIONS + 1, thread_name_prefix="database"
+)
+
+# Most workers the calls of one database file can hold at once, so calls
+# waiting on one guild's writer always leave workers for the other guilds
+GUILD_WORKERS = 2
+_guild_workers = {}
+
+# Open pools in least recently used order. Every pool holds a few file
+# descriptors, so only max_open_pools are kept open and idle ones are closed
+# to make room, a pool is idle when no OpenDatabase is using it.
+_pools = collections.OrderedDict()
+_pools_lock = threading.Lock()
+max_open_pools = 32
+
+# Every guild gets its own database file under guilds_directory so writes in
+# one guild never wait on another guild's writer connection. Direct messages
+# and the legacy guild keep using the original database file.
+DEFAULT_DATABASE = "./quotes.db"
+guilds_directory = "./guilds"
+legacy_guild_id = 0
+
+_guilds = {}
+_guilds_lock = threading.Lock()
+
+# Guessing game results waiting to be written by flush_scores, keyed by
+# (guild id, user id) with [correct, wrong] counts
+_pending_scores = {}
+_scores_lock = threading.Lock()
+
+
+class FairLock:
+    """
+    Lock handed to the threads waiting for it in the order they asked, so a
+    thread releasing and acquiring it again in a loop can't starve others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self._locked = False
+
+    def acquire(self) -> None:
+        with self._lock:
+            if not self._locked:
+                self._locked = True
+                return
+            waiter = threading.Lock()
+            waiter.acquire()
+            self._waiters.append(waiter)
+        # Released by release, which hands the lock over without unlocking it
+        waiter.acquire()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().release()
+            else:
+                self._locked = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_class, exc, traceback):
+        self.release()
+
+
+class ConnectionPool:
+    """
+    Long-lived SQLite3 connections for a single database file. Writes are
+    serialized through one writer connection while reads borrow from a pool
+    of read connections. The database runs in WAL mode so readers never
+    block the writer. Read connections are only opened once reads overlap,
+    so a guild that is rarely used keeps a single connection open.
+
+    Args:
+        path (str): SQLite database filepath
+        readers (int): Most read connections to open
+    """
+
+    pragmas = (
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA foreign_keys=ON",
+    )
+
+    def __init__(self, path: str, readers: int = READ_CONNECTIONS):
+        self.path = path
+        self._write_lock = FairLock()
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._readers = queue.SimpleQueue()
+        self._max_readers = readers
+        self._opened_readers = 0
+        self._readers_lock = threading.Lock()
+        # Number of OpenDatabase users, the pool is only closed at 0
+        self.leases = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # cached_statements keeps the prepared statements for every query
+        # in this module alive for the lifetime of the connection
+        conn = sqlite3.connect(
+            self.path, timeout=10, check_same_thread=False, cached_statements=256
+        )
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def acquire_writer(self) -> sqlite3.Connection:
+        self._write_lock.acquire()
+        return self._writer
+
+    def release_writer(self) -> None:
+        self._write_lock.release()
+
+    def acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            with self._readers_lock:
+                if self._opened_readers < self._max_readers:
+                    self._opened_readers += 1
+                    return self._connect()
+        return self._readers.get()
+
+    def release_reader(self, conn: sqlite3.Connection) -> None:
+        self._readers.put(conn)
+
+    def close(self) -> None:
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+
+def _close_idle_pools() -> None:
+    # Called with _pools_lock held
+    for key, pool in list(_pools.items()):
+        if len(_pools) <= max_open_pools:
+            break
+        if pool.leases == 0:
+            _close_pool(key)
+
+
+def _close_pool(key: str) -> None:
+    # Called with _pools_lock held
+    module_logger.debug(f"Closing connection pool for {key}")
+    # The guild's indexes stay loaded, the changes version tells on reopening
+    # whether anything changed while the pool was closed
+    _pools.pop(key).close()
+
+
+def get_pool(path: str) -> ConnectionPool:
+    """
+    Lease the process-wide connection pool for a database file, opening it
+    if needed. Every lease must be returned with release_pool.
+
+    Args:
+        path (str): SQLite database filepath
+    Returns:
+        ConnectionPool: Pool for the database file
+    """
+    key = os.path.abspath(path)
+    with _pools_lock:
+        if key not in _pools:
+            module_logger.debug(f"Opening connection pool for {key}")
+            _pools[key] = ConnectionPool(key)
+        _pools.move_to_end(key)
+        pool = _pools[key]
+        pool.leases += 1
+        _close_idle_pools()
+        return pool
+
+
+def release_pool(pool: ConnectionPool) -> None:
+    """Return a lease taken by get_pool."""
+    with _pools_lock:
+        pool.leases -= 1
+        _close_idle_pools()
+
+
+def close_pool(path: str) -> None:
+    """Close the connection pool of a database file if it is open and idle."""
+    key = os.path.abspath(path)
+    with _pools_lock:
+        if key in _pools and _pools[key].leases == 0:
+            _close_pool(key)
+
+
+def close_pools() -> None:
+    """Close every open connection pool."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
 
 class OpenDatabase:
     """
-    SQLite3 context manager used for automatically opening and closing
-    connections.
+    SQLite3 context manager that borrows a connection from the process-wide
+    pool. Changes are committed on a clean exit and rolled back otherwise.
 
     Args:
-        object (str): SQLite database filepath
+        path (str): SQLite database filepath
+        write (bool): Borrow the writer connection instead of a reader
     """
 
-    def __init__(self, path):
+    def __init__(self, path, write=False):
         self.path = path
+        self.write = write
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.path)
+        self.pool = get_pool(self.path)
+        try:
+            if self.write:
+                self.conn = self.pool.acquire_writer()
+            else:
+                self.conn = self.pool.acquire_reader()
+        except BaseException:
+            release_pool(self.pool)
+            raise
         self.cursor = self.conn.cursor()
         return self.cursor
 
     def __exit__(self, exc_class, exc, traceback):
-        self.conn.commit()
-        self.conn.close()
+        try:
+            if exc_class is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.cursor.close()
+            if self.write:
+                self.pool.release_writer()
+            else:
+                self.pool.release_reader(self.conn)
+            release_pool(self.pool)
 
 
-def create_db(db_name: str) -> None:
+class AddQuoteResult(enum.Enum):
+    ADDED = enum.auto()
+    NO_NAME = enum.auto()
+    DUPLICATE = enum.auto()
+    SIMILAR = enum.auto()
+
+
+class GuildDatabase:
+    """
+    Database file of a single guild along with its write-through caches of
+    the people and quotes tables. Every write in this module updates them
+    while holding the writer connection, edits made by other processes are
+    picked up through the version in the changes table. The near duplicate
+    index is only built once a quote is added.
+
+    Args:
+        path (str): SQLite database filepath
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.quote_index = QuoteIndex()
+        self.name_index = NameIndex()
+        self.near_duplicates = None
+        self.near_duplicates_lock = threading.Lock()
+        # Version of the changes table the indexes match, None until loaded
+        self.version = None
+
+
+def _read_version(cursor: sqlite3.Cursor) -> int:
+    cursor.execute("SELECT version FROM changes")
+    return cursor.fetchone()[0]
+
+
+class WriteGuild(OpenDatabase):
+    """
+    Writer connection of a guild for changes to its people and quotes
+    tables. The transaction starts with BEGIN IMMEDIATE so nothing else can
+    change the database until it commits. If the guild's indexes matched the
+    database before the change they are marked as matching it after, the
+    caller updates them along with the tables.
+
+    Args:
+        guild (GuildDatabase): Guild to change
+    """
+
+    def __init__(self, guild: GuildDatabase):
+        super().__init__(guild.path, write=True)
+        self.guild = guild
+
+    def __enter__(self):
+        cursor = super().__enter__()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            self.version = _read_version(cursor)
+        except BaseException as e:
+            super().__exit__(type(e), e, e.__traceback__)
+            raise
+        return cursor
+
+    def __exit__(self, exc_class, exc, traceback):
+        version = None
+        if exc_class is None:
+            try:
+                version = _read_version(self.cursor)
+            except BaseException as e:
+                super().__exit__(type(e), e, e.__traceback__)
+                raise
+        super().__exit__(exc_class, exc, traceback)
+        if exc_class is None and self.guild.version == self.version:
+            self.guild.version = version
+
+
+def configure(directory: str, legacy_guild: int = 0, max_open: int = 32) -> None:
+    """
+    Set where guild databases are stored. Call before the first query.
+
+    Args:
+        directory (str): Directory holding one database file per guild
+        legacy_guild (int): Guild that keeps using the original quotes.db,
+            0 if only direct messages do
+        max_open (int): Database files kept open at once
+    """
+    global guilds_directory, legacy_guild_id, max_open_pools
+    guilds_directory = directory
+    legacy_guild_id = legacy_guild
+    max_open_pools = max_open
+
+
+def database_path(guild_id: int) -> str:
     """
-    Create a database with people and quotes tables. The people table contains
-    one column "name". Each record under "name" must be unique. The quotes
-    table contains the columns' id, name, and quote. The ID column must be
-    unique. The name column is a foreign key to the name column in the people
-    table.
+    Return the database filepath for a guild.
 
     Args:
-        db_name (str): name of the database file to create
+        guild_id (int): Guild id, 0 for direct messages
+    Returns:
+        str: SQLite database filepath
     """
-    create_people_table = """CREATE TABLE IF NOT EXISTS people(
-                                'name' TEXT NOT NULL UNIQUE
-                            );"""
+    if guild_id in (0, legacy_guild_id):
+        return DEFAULT_DATABASE
+    return os.path.join(guilds_directory, f"{guild_id}.db")
+
 
-    create_quotes_table = """CREATE TABLE IF NOT EXISTS quotes(
-                                'id' INTEGER NOT NULL UNIQUE,
-                                'name' TEXT NOT NULL,
-                                'quote' TEXT NOT NULL,
-                                FOREIGN KEY('name')
-                                REFERENCES 'people'('name'),
-                                PRIMARY KEY('id' AUTOINCREMENT)
-                            );"""
-    with OpenDatabase(db_name) as cursor:
-        cursor.execute(create_people_table)
-        cursor.execute(create_quotes_table)
+def _open_database(path: str) -> GuildDatabase:
+    key = os.path.abspath(path)
+    with _guilds_lock:
+        if key not in _guilds:
+            os.makedirs(os.path.dirname(key), exist_ok=True)
+            create_db(key)
+            _guilds[key] = GuildDatabase(key)
+        return _guilds[key]
 
 
-def get_names() -> str:
+def get_guild(guild_id: int) -> GuildDatabase:
     """
-    Return a string with all the names recorded in the people table.
+    Return the database of a guild, creating the file and its tables on
+    first use.
 
+    Args:
+        guild_id (int): Guild id, 0 for direct messages
     Returns:
-        str: String value containing the names separated by commas
+        GuildDatabase: Database of the guild
     """
-    with OpenDatabase("./quotes.db") as cursor:
-        cursor.execute("SELECT name FROM people")
-        names = [v[0] for v in cursor.fetchall()]
-        names.sort()
-        names = ", ".join(
-            map(
-                str,
-                names,
-            )
+    return _open_database(database_path(guild_id))
+
+
+def database_files() -> list:
+    """
+    Returns:
+        list: Filepaths of quotes.db and every guild database on disk
+    """
+    paths = [DEFAULT_DATABASE]
+    if os.path.isdir(guilds_directory):
+        paths += sorted(
+            os.path.join(guilds_directory, name)
+            for name in os.listdir(guilds_directory)
+            if name.endswith(".db")
         )
-        return names
+    return paths
 
 
-def get_names_list() -> list:
+def migrate_databases() -> int:
     """
-    Return a list of the first 20 names in the people table in alphabetical
-    order.
+    Apply pending migrations to quotes.db and every guild database already
+    on disk, so upgrades happen at startup instead of on a guild's first
+    command.
 
     Returns:
-        list: List of names
+        int: Number of databases opened
     """
-    with OpenDatabase("./quotes.db") as cursor:
-        cursor.execute("SELECT name FROM people")
-        names_list = [v[0] for v in cursor.fetchall()]
-        names_list.sort()
-        return names_list[:20]
+    paths = database_files()
+    for path in paths:
+        _open_database(path)
+        if path != DEFAULT_DATABASE:
+            # Guild databases are reopened by the guild's first command
+            close_pool(path)
+    return len(paths)
 
 
-def add_name(name: str) -> None:
+def create_db(db_name: str) -> None:
     """
-    Adds a name to the people table.
+    Create a database or bring an existing one up to the latest schema by
+    applying the migrations it doesn't have yet.
 
     Args:
-        name (str): String to add to the people table
+        db_name (str): name of the database file to create or upgrade
+    """
+    pool = get_pool(db_name)
+    conn = pool.acquire_writer()
+    try:
+        migrations.migrate(conn, db_name)
+    finally:
+        pool.release_writer()
+        release_pool(pool)
+
+
+def _load_indexes(guild: GuildDatabase, cursor: sqlite3.Cursor) -> None:
+    cursor.execute("SELECT name FROM people")
+    names = [v[0] for v in cursor.fetchall()]
+    cursor.execute("SELECT id, name FROM quotes")
+    guild.quote_index.load(names, cursor.fetchall())
+    # Swap in a fresh name index so autocomplete never sees a partial build
+    guild.name_index = NameIndex(names)
+    guild.near_duplicates = None
+    module_logger.debug(
+        f"Loaded indexes for {guild.path} with {len(guild.quote_index)} names"
+    )
+
+
+def _load_near_duplicates(cursor: sqlite3.Cursor, threshold: float = 0.8) -> tuple:
+    index = NearDuplicateIndex(threshold)
+    missing = []
+    cursor.execute("SELECT id, name, quote, minhash FROM quotes")
+    while rows := cursor.fetchmany(1000):
+        for quote_id, name, quote, signature in rows:
+            # Imported quotes and quotes added by something other than the
+            # bot don't have one
+            if signature is None:
+                signature = NearDuplicateIndex.signature(quote)
+                missing.append((signature, quote_id, quote))
+            index.add(quote_id, name, quote, signature)
+    return index, missing
+
+
+def _build_near_duplicates(guild: GuildDatabase, batch_size: int = 10000) -> None:
     """
-    with OpenDatabase("./quotes.db") as cursor:
-        cursor.execute("INSERT INTO people ('name') VALUES (?)", (name,))
+    Build the near duplicate index of a guild from a read snapshot, so the
+    writer isn't held while missing signatures are computed, and save those
+    signatures so the next build doesn't compute them again. The index is
+    only used if nothing changed the quotes since the snapshot.
+    """
+    with guild.near_duplicates_lock:
+        if guild.near_duplicates is not None:
+            return
+        with OpenDatabase(guild.path) as cursor:
+            cursor.execute("BEGIN")
+            version = _read_version(cursor)
+            index, missing = _load_near_duplicates(cursor)
+        for start in range(0, len(missing), batch_size):
+            with OpenDatabase(guild.path, write=True) as cursor:
+                cursor.executemany(
+                    "UPDATE quotes SET minhash = ? WHERE id = ? AND quote = ?",
+                    missing[start : start + batch_size],
+                )
+        with OpenDatabase(guild.path, write=True) as cursor:
+            if guild.near_duplicates is None and _read_version(cursor) == version:
+                guild.near_duplicates = index
+
 
+def _sync_indexes(guild: GuildDatabase) -> None:
+    with OpenDatabase(guild.path, write=True) as cursor:
+        # Read the version and the tables from the same snapshot
+        cursor.execute("BEGIN")
+        version = _read_version(cursor)
+        if version != guild.version:
+            _load_indexes(guild, cursor)
+            guild.version = version
 
-def remove_name(name: str) -> None:
+
+def sync_indexes(guild_id: int = 0) -> GuildDatabase:
     """
-    Remove associated quotes first then remove the name entry from the
-    people table. This action is not reversible.
+    Populate the in-memory name and quote indexes of a guild from its people
+    and quotes tables if they have not been loaded yet or another process has
+    changed the database since they were. The version is checked on a read
+    connection, the writer is only needed to load the indexes.
 
     Args:
-        name (str): Name entry to remove from the database if it exists
+        guild_id (int): Guild to sync
+    Returns:
+        GuildDatabase: Database of the guild
     """
-    with OpenDatabase("./quotes.db") as cursor:
-        cursor.execute("DELETE FROM quotes WHERE name == (?);", (name,))
-        cursor.execute("DELETE FROM people WHERE name == (?);", (name,))
+    guild = get_guild(guild_id)
+    with OpenDatabase(guild.path) as cursor:
+        current = _read_version(cursor) == guild.version
+    if not current:
+        _sync_indexes(guild)
+    return guild
 
 
-def verify_name(name: str) -> bool:
+def get_name_index(guild_id: int) -> NameIndex:
     """
-    Verify if the name provided has an entry in the people table and returns a
-    boolean.
+    Return the autocomplete index of a guild's names.
 
     Args:
-        name (str): Value to check
+        guild_id (int): Guild the names belong to
     Returns:
-        bool: True or false the name provided exists
+        NameIndex: Index of the guild's names
     """
-    with OpenDatabase("./quotes.db") as cursor:
-        cursor.execute("SELECT count(name) FROM people WHERE name=?", (name,))
-        return cursor.fetchone()[0] == 1
+    return sync_indexes(guild_id).name_index
 
 
-def get_random_quote(name: str) -> str:
+def get_names_page(
+    guild_id: int,
+    after: str | None = None,
+    before: str | None = None,
+    limit: int = 20,
+) -> tuple:
     """
-    Retrieves a random quote from the database by name in the quotes table.
-    If no quotes are found return a message letting the user know there
-    are no quotes attributed to the provided name.
+    Return one page of names in alphabetical order along with how many quotes
+    are attributed to each. Pages are selected with a keyset cursor on the
+    name column so only the rows of the requested page are read.
 
     Args:
-        name (str): Retrieve a random quote attributed to this name
+        guild_id (int): Guild the names belong to
+        after (str): Return the names following this name
+        before (str): Return the names preceding this name
+        limit (int): Maximum number of names on the page
     Returns:
-        str: String containing a random quote or an error message
+        tuple: List of (name, quote count) tuples and whether more names exist
+        past the page in the direction requested
     """
-    with OpenDatabase("./quotes.db") as cursor:
-        try:
+    select = """SELECT name, (SELECT count(*) FROM quotes WHERE quotes.name = people.name)
+                FROM people"""
+    with OpenDatabase(get_guild(guild_id).path) as cursor:
+        if before is not None:
             cursor.execute(
-                "SELECT quote FROM quotes WHERE name=? ORDER BY RANDOM() LIMIT 1",
-                (name,),
+                f"{select} WHERE name < ? ORDER BY name DESC LIMIT ?",
+                (before, limit + 1),
+            )
+            rows = cursor.fetchall()
+            return rows[:limit][::-1], len(rows) > limit
+        cursor.execute(
+            f"{select} WHERE name > ? ORDER BY name LIMIT ?",
+            ("" if after is None else after, limit + 1),
+        )
+        rows = cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+
+
+def add_name(guild_id: int, name: str) -> bool:
+    """
+    Adds a name to the people table unless it is already there.
+
+    Args:
+        guild_id (int): Guild to add the name to
+        name (str): String to add to the people table
+    Returns:
+        bool: False if the name was already in the people table
+    """
+    guild = get_guild(guild_id)
+    with WriteGuild(guild) as cursor:
+        cursor.execute(
+            "INSERT INTO people ('name') VALUES (?) ON CONFLICT DO NOTHING", (name,)
+        )
+        if cursor.rowcount == 0:
+            return False
+        guild.quote_index.add_name(name)
+        guild.name_index.add(name)
+        return True
+
+
+def remove_name(guild_id: int, name: str) -> bool:
+    """
+    Remove the name entry from the people table, its quotes are removed with
+    it by the foreign key cascade. This action is not reversible.
+
+    Args:
+        guild_id (int): Guild to remove the name from
+        name (str): Name entry to remove from the database if it exists
+    Returns:
+        bool: False if the name was not in the people table
+    """
+    guild = get_guild(guild_id)
+    with WriteGuild(guild) as cursor:
+        cursor.execute("DELETE FROM people WHERE name == (?) RETURNING name;", (name,))
+        if cursor.fetchone() is None:
+            return False
+    # Only drop the name from memory once the delete has been committed
+    guild.quote_index.remove_name(name)
+    guild.name_index.remove(name)
+    if guild.near_duplicates is not None:
+        guild.near_duplicates.remove_name(name)
+    return True
+
+
+def _random_quote(
+    guild: GuildDatabase, cursor: sqlite3.Cursor, name: str, channel_id: int | None
+) -> tuple:
+    while True:
+        quote_id = guild.quote_index.random_quote_id(name, channel_id)
+        cursor.execute(
+            """SELECT quotes.id, quotes.quote FROM people
+            LEFT JOIN quotes ON quotes.name = people.name AND quotes.id = coalesce(
+                ?,
+                (SELECT id FROM quotes WHERE name = people.name
+                ORDER BY random() LIMIT 1)
             )
-            result = cursor.fetchone()
-            return str(result[0])
-        except TypeError:
-            return f"{name} does not have any quotes"
+            WHERE people.name = ?""",
+            (quote_id, name),
+        )
+        result = cursor.fetchone()
+        if result is None:
+            return False, None
+        if result[0] is not None or quote_id is None:
+            return True, result[1]
+        # Removed outside of the bot, drop it and pick again
+        guild.quote_index.remove_quote(name, quote_id)
+
+
+def get_random_quote(guild_id: int, name: str, channel_id: int | None = None) -> tuple:
+    """
+    Retrieves a random quote attributed to a name with a single query that
+    also tells whether the name exists. The quote is picked from the
+    in-memory index when it has the name, otherwise by SQLite. The index is
+    checked against the changes version in the same read transaction, the
+    writer is only used when the index has to be loaded first.
+
+    Args:
+        guild_id (int): Guild the quotes belong to
+        name (str): Retrieve a random quote attributed to this name
+        channel_id (int): Channel the quote is for, quotes don't repeat in a
+            channel until it has seen all of the name's quotes. None picks
+            with replacement
+    Returns:
+        tuple: Whether the name is in the people table and a random quote,
+        None if the name has no quotes
+    """
+    guild = get_guild(guild_id)
+    with OpenDatabase(guild.path) as cursor:
+        cursor.execute("BEGIN")
+        if _read_version(cursor) == guild.version:
+            return _random_quote(guild, cursor, name, channel_id)
+    # The guild's first use or another process changed the database
+    _sync_indexes(guild)
+    with OpenDatabase(guild.path) as cursor:
+        return _random_quote(guild, cursor, name, channel_id)
 
 
-def add_quote(name: str, quote: str) -> None:
+def add_quote(guild_id: int, name: str, quote: str) -> AddQuoteResult:
     """
-    Add an attributed quote to the database.
+    Add an attributed quote to the database if the name exists and doesn't
+    already have the same or a nearly identical quote. Exact duplicates,
+    ignoring case, punctuation and spacing, are rejected by the unique
+    quotes_hash_idx, near duplicates by the in-memory MinHash index.
 
     Args:
+        guild_id (int): Guild to add the quote to
         name (str): Name used for database entry
         quote (str): Quote used for database entry
+    Returns:
+        AddQuoteResult: Whether the quote was added and why not
     """
-    with OpenDatabase("./quotes.db") as cursor:
+    guild = get_guild(guild_id)
+    digest = quote_hash(quote)
+    signature = NearDuplicateIndex.signature(quote)
+    if guild.near_duplicates is None:
+        _build_near_duplicates(guild)
+    with WriteGuild(guild) as cursor:
+        if guild.near_duplicates is None:
+            # The quotes changed after the index was built
+            guild.near_duplicates, _ = _load_near_duplicates(cursor)
+        if guild.near_duplicates.similar(name, quote, signature):
+            cursor.execute(
+                "SELECT 1 FROM quotes WHERE name = ? AND quote_hash = ?",
+                (name, digest),
+            )
+            if cursor.fetchone() is not None:
+                return AddQuoteResult.DUPLICATE
+            return AddQuoteResult.SIMILAR
         cursor.execute(
-            "INSERT INTO quotes ('name', 'quote') VALUES (?, ?)",
-            (
-                name,
-                quote,
-            ),
+            """INSERT INTO quotes ('name', 'quote', 'quote_hash', 'minhash')
+            SELECT name, ?, ?, ? FROM people WHERE name = ?
+            ON CONFLICT DO NOTHING
+            RETURNING id""",
+            (quote, digest, signature, name),
         )
+        result = cursor.fetchone()
+        if result is None:
+            cursor.execute("SELECT 1 FROM people WHERE name = ?", (name,))
+            if cursor.fetchone() is None:
+                return AddQuoteResult.NO_NAME
+            return AddQuoteResult.DUPLICATE
+        guild.quote_index.add_quote(name, result[0])
+        guild.near_duplicates.add(result[0], name, quote, signature)
+        return AddQuoteResult.ADDED
 
 
-def get_random_name() -> str:
+def get_random_name(guild_id: int, weighted: bool = False) -> str:
     """
     Retrieve a random name from the people table.
 
+    Args:
+        guild_id (int): Guild the names belong to
+        weighted (bool): Pick names in proportion to their number of quotes
     Returns:
         str: Value containing a random name entry
     """
-    with OpenDatabase("./quotes.db") as cursor:
-        cursor.execute("SELECT name FROM people")
-        names_list = [v[0] for v in cursor.fetchall()]
-        return str(random.choice(names_list))
+    return str(sync_indexes(guild_id).quote_index.random_name(weighted))
 
 
-def list_quotes(name: str) -> list:
+def list_quotes(guild_id: int, name: str) -> list:
     """
     Unused function to retrieve a list of all the quotes attributed to the
     given name.
 
     Args:
+        guild_id (int): Guild the quotes belong to
         name (str): Name used to retrieve all quotes
     Returns:
         list: List of string values
     """
-    with OpenDatabase("./quotes.db") as cursor:
+    with OpenDatabase(get_guild(guild_id).path) as cursor:
         cursor.execute("SELECT * FROM quotes WHERE name == (?);", (name,))
         return cursor.fetchall()
+
+
+def import_quotes(guild_id: int, rows, batch_size: int = 10000, progress=None) -> tuple:
+    """
+    Bulk load names and quotes into the database. Rows are inserted in
+    batches with executemany, each batch committed in its own transaction.
+    The writer is released between batches so the guild's other commands
+    don't wait for the whole import. Names are lowercased like the commands
+    do, quotes that the name already has are skipped by the unique
+    quotes_hash_idx. Near duplicates are imported, find_duplicates reports
+    them afterwards. Signatures are left for the near duplicate index to
+    compute when it is built. The indexes are reloaded once the import ends.
+
+    Args:
+        guild_id (int): Guild to import the quotes into
+        rows (iterable): (name, quote) tuples, quote may be None to only add
+            the name
+        batch_size (int): Number of rows inserted per transaction
+        progress (callable): Called with the number of rows processed after
+            every batch
+    Returns:
+        tuple: Number of names added, quotes added and duplicate quotes skipped
+    Raises:
+        ValueError: A row is not a pair of strings, the batches before it
+            stay imported
+    """
+    names_added = quotes_added = quote_rows = processed = 0
+    guild = get_guild(guild_id)
+    rows = iter(rows)
+    try:
+        while chunk := list(itertools.islice(rows, batch_size)):
+            for number, row in enumerate(chunk, start=processed + 1):
+                if (
+                    len(row) != 2
+                    or not isinstance(row[0], str | None)
+                    or not isinstance(row[1], str | None)
+                ):
+                    raise ValueError(f"Row {number} is not a name and quote")
+            batch = [
+                (name.strip().lower(), quote)
+                for name, quote in chunk
+                if name and name.strip()
+            ]
+            quotes = [
+                (name, quote, quote_hash(quote)) for name, quote in batch if quote
+            ]
+            quote_rows += len(quotes)
+            # The indexes stay marked current while the batches are written,
+            # so commands in between don't reload them for every batch
+            with WriteGuild(guild) as cursor:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO people ('name') VALUES (?)",
+                    [(name,) for name, _ in batch],
+                )
+                names_added += cursor.rowcount
+                cursor.executemany(
+                    """INSERT INTO quotes ('name', 'quote', 'quote_hash')
+                    VALUES (?, ?, ?) ON CONFLICT DO NOTHING""",
+                    quotes,
+                )
+                quotes_added += cursor.rowcount
+            processed += len(chunk)
+            if progress is not None:
+                progress(processed)
+    finally:
+        # Earlier batches are committed even if a later one fails, the
+        # indexes have to include them
+        guild.version = None
+        _sync_indexes(guild)
+    return names_added, quotes_added, quote_rows - quotes_added
+
+
+def find_duplicates(guild_id: int, threshold: float = 0.8) -> list:
+    """
+    Scan every quote of a guild for near duplicates of the same name. Each
+    quote is only compared with the earlier quotes it shares a MinHash band
+    with, and matches are joined into clusters with a union-find.
+
+    Args:
+        guild_id (int): Guild to scan
+        threshold (float): Shingle similarity above which quotes are merged
+            into a cluster
+    Returns:
+        list: Clusters of (id, name, quote) tuples ordered by id, only
+        clusters with more than one quote are returned
+    """
+    index = NearDuplicateIndex(threshold)
+    parents = {}
+    quotes = {}
+
+    def find(quote_id: int) -> int:
+        while parents[quote_id] != quote_id:
+            parents[quote_id] = parents[parents[quote_id]]
+            quote_id = parents[quote_id]
+        return quote_id
+
+    with OpenDatabase(get_guild(guild_id).path) as cursor:
+        cursor.execute("SELECT id, name, quote, minhash FROM quotes ORDER BY id")
+        while rows := cursor.fetchmany(1000):
+            for quote_id, name, quote, signature in rows:
+                signature = signature or NearDuplicateIndex.signature(quote)
+                quotes[quote_id] = (quote_id, name, quote)
+                parents[quote_id] = quote_id
+                for match in index.similar(name, quote, signature):
+                    root, other = find(quote_id), find(match)
+                    parents[max(root, other)] = min(root, other)
+                index.add(quote_id, name, quote, signature)
+
+    clusters = {}
+    for quote_id, row in quotes.items():
+        clusters.setdefault(find(quote_id), []).append(row)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+
+def merge_duplicates(guild_id: int, clusters: list) -> int:
+    """
+    Keep the oldest quote of every cluster found by find_duplicates and
+    remove the rest.
+
+    Args:
+        guild_id (int): Guild the clusters were found in
+        clusters (list): Clusters of (id, name, quote) tuples ordered by id
+    Returns:
+        int: Number of quotes removed
+    """
+    duplicates = [row for cluster in clusters for row in cluster[1:]]
+    guild = get_guild(guild_id)
+    with WriteGuild(guild) as cursor:
+        cursor.executemany(
+            "DELETE FROM quotes WHERE id = ?",
+            [(quote_id,) for quote_id, _, _ in duplicates],
+        )
+        for quote_id, name, _ in duplicates:
+            guild.quote_index.remove_quote(name, quote_id)
+            if guild.near_duplicates is not None:
+                guild.near_duplicates.remove(quote_id)
+        return cursor.rowcount
+
+
+def snapshot_database(path: str, destination: str, pages: int = 256) -> None:
+    """
+    Copy a database to a new file with the SQLite online backup API. The copy
+    is made a number of pages at a time through its own read-only
+    connection, so it never holds the writer or a pooled reader and the
+    bot's writes only wait for a single step. A write made between steps
+    restarts the copy, the result is always a consistent snapshot.
+
+    Args:
+        path (str): SQLite database filepath
+        destination (str): Filepath of the snapshot, replaced if it exists
+        pages (int): Pages copied per step
+    """
+    source = sqlite3.connect(
+        f"{pathlib.Path(path).absolute().as_uri()}?mode=ro", uri=True
+    )
+    target = sqlite3.connect(destination)
+    try:
+        source.backup(target, pages=pages)
+        # Make the snapshot a single self-contained file
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+
+
+def restore_database(guild_id: int, snapshot: str) -> None:
+    """
+    Replace a guild's database with the contents of a snapshot. The whole
+    snapshot is copied in one step while holding the writer, so readers see
+    either the old or the restored database. Older snapshots are migrated
+    and the in-memory indexes are rebuilt.
+
+    Args:
+        guild_id (int): Guild whose database is replaced
+        snapshot (str): Filepath of an uncompressed snapshot
+    """
+    guild = get_guild(guild_id)
+    pool = get_pool(guild.path)
+    source = sqlite3.connect(snapshot)
+    conn = pool.acquire_writer()
+    try:
+        source.backup(conn)
+        migrations.migrate(conn, guild.path)
+        cursor = conn.cursor()
+        _load_indexes(guild, cursor)
+        guild.version = _read_version(cursor)
+        cursor.close()
+    finally:
+        pool.release_writer()
+        release_pool(pool)
+        source.close()
+    module_logger.warning(f"Restored {guild.path} from {snapshot}")
+
+
+def export_quotes(guild_id: int):
+    """
+    Stream every name and quote in the database ordered by name. Names
+    without any quotes are returned with a quote of None.
+
+    Args:
+        guild_id (int): Guild to export
+    Yields:
+        tuple: (name, quote) tuples
+    """
+    with OpenDatabase(get_guild(guild_id).path) as cursor:
+        cursor.execute(
+            """SELECT people.name, quotes.quote FROM people
+            LEFT JOIN quotes ON quotes.name = people.name
+            ORDER BY people.name, quotes.id"""
+        )
+        while rows := cursor.fetchmany(1000):
+            yield from rows
+
+
+def record_guess(guild_id: int, user_id: int, correct: bool) -> None:
+    """
+    Count a guess from the guessing game. Guesses are only buffered in memory
+    and written by flush_scores, so this never touches the database.
+
+    Args:
+        guild_id (int): Guild the game was played in
+        user_id (int): User that guessed
+        correct (bool): Whether the guess was right
+    """
+    with _scores_lock:
+        counts = _pending_scores.setdefault((guild_id, user_id), [0, 0])
+        counts[0 if correct else 1] += 1
+
+
+def flush_scores() -> int:
+    """
+    Write every buffered guess to the scores table of its guild, one
+    transaction per guild. The guesses of a guild whose write fails go back
+    into the buffer for the next flush, the other guilds are still written
+    and the first error is raised afterwards.
+
+    Returns:
+        int: Number of users whose scores were updated
+    """
+    global _pending_scores
+    with _scores_lock:
+        pending, _pending_scores = _pending_scores, {}
+    by_guild = {}
+    for (guild_id, user_id), (correct, wrong) in pending.items():
+        by_guild.setdefault(guild_id, []).append((guild_id, user_id, correct, wrong))
+    written = 0
+    error = None
+    for guild_id, rows in by_guild.items():
+        try:
+            with OpenDatabase(get_guild(guild_id).path, write=True) as cursor:
+                cursor.executemany(
+                    """INSERT INTO scores ('guild_id', 'user_id', 'correct', 'wrong')
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                        correct = correct + excluded.correct,
+                        wrong = wrong + excluded.wrong""",
+                    rows,
+                )
+        except (OSError, sqlite3.Error) as e:
+            # Guesses made since the swap may already be buffered again
+            with _scores_lock:
+                for _, user_id, correct, wrong in rows:
+                    counts = _pending_scores.setdefault((guild_id, user_id), [0, 0])
+                    counts[0] += correct
+                    counts[1] += wrong
+            if error is None:
+                error = e
+            continue
+        written += len(rows)
+    if error is not None:
+        raise error
+    return written
+
+
+def get_leaderboard(guild_id: int, limit: int = 10) -> list:
+    """
+    Return the users with the most correct guesses in a guild, read in order
+    from the ranking index.
+
+    Args:
+        guild_id (int): Guild to rank
+        limit (int): Number of users to return
+    Returns:
+        list: (user id, correct, wrong) tuples, best first
+    """
+    flush_scores()
+    with OpenDatabase(get_guild(guild_id).path) as cursor:
+        cursor.execute(
+            """SELECT user_id, correct, wrong FROM scores
+            WHERE guild_id = ? ORDER BY correct DESC LIMIT ?""",
+            (guild_id, limit),
+        )
+        return cursor.fetchall()
+
+
+def search_quotes(
+    guild_id: int, query: str, page: int = 1, per_page: int = 10
+) -> tuple:
+    """
+    Search the quotes by content using the full-text index. Results are ranked
+    by bm25 and the matching terms are highlighted in bold.
+
+    Args:
+        guild_id (int): Guild the quotes belong to
+        query (str): Words to search for
+        page (int): 1-indexed page of results to return
+        per_page (int): Number of results per page
+    Returns:
+        tuple: Total number of matches and a list of (name, snippet) tuples
+    """
+    # Quote every word so user input is never parsed as FTS5 query syntax
+    match = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+    if not match:
+        return 0, []
+
+    with OpenDatabase(get_guild(guild_id).path) as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM quotes_fts WHERE quotes_fts MATCH ?", (match,)
+        )
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            """SELECT name, snippet(quotes_fts, 0, '**', '**', '…', 24)
+            FROM quotes_fts WHERE quotes_fts MATCH ?
+            ORDER BY rank LIMIT ? OFFSET ?""",
+            (match, per_page, (page - 1) * per_page),
+        )
+        return total, cursor.fetchall()
+
+
+def get_timezones(guild_id: int, user_id: int = 0) -> list:
+    """
+    Return the timezone list saved for a guild, or for a user if user_id is
+    given. User lists are kept in the direct message database so they follow
+    the user across guilds.
+
+    Args:
+        guild_id (int): Guild the list belongs to, ignored for users
+        user_id (int): User the list belongs to, 0 for the guild's list
+    Returns:
+        list: Timezone names in display order, empty if none are saved
+    """
+    if user_id:
+        guild_id = 0
+    with OpenDatabase(get_guild(guild_id).path) as cursor:
+        cursor.execute(
+            """SELECT timezone FROM timezones
+            WHERE guild_id = ? AND user_id = ? ORDER BY position""",
+            (guild_id, user_id),
+        )
+        return [v[0] for v in cursor.fetchall()]
+
+
+def set_timezones(guild_id: int, user_id: int, timezones: list) -> None:
+    """
+    Replace the timezone list saved for a guild or a user, an empty list
+    removes it.
+
+    Args:
+        guild_id (int): Guild the list belongs to, ignored for users
+        user_id (int): User the list belongs to, 0 for the guild's list
+        timezones (list): Timezone names in display order
+    """
+    if user_id:
+        guild_id = 0
+    with OpenDatabase(get_guild(guild_id).path, write=True) as cursor:
+        cursor.execute(
+            "DELETE FROM timezones WHERE guild_id = ? AND user_id = ?",
+            (guild_id, user_id),
+        )
+        cursor.executemany(
+            """INSERT INTO timezones ('guild_id', 'user_id', 'position', 'timezone')
+            VALUES (?, ?, ?, ?)""",
+            [
+                (guild_id, user_id, position, timezone)
+                for position, timezone in enumerate(timezones)
+            ],
+        )
+
+
+async def run_in_thread(func, /, *args, **kwargs):
+    """
+    Run a blocking database function on the database worker thread and await
+    its result without blocking the event loop.
+
+    Args:
+        func (callable): Database function to run
+    Returns:
+        The return value of func
+    """
+    loop = asyncio.get_running_loop()
+    queued = time.perf_counter()
+
+    def timed_call():
+        metrics.observe(
+            "database_queue_seconds",
+            time.perf_counter() - queued,
+            function=func.__name__,
+        )
+        with metrics.timer("database_query_seconds", function=func.__name__):
+            return func(*args, **kwargs)
+
+    return await loop.run_in_executor(_executor, timed_call)
+
+
+async def run_in_guild_thread(func, guild_id: int, /, *args, **kwargs):
+    """
+    Same as run_in_thread for a function whose first argument is a guild id.
+    At most GUILD_WORKERS calls for the guild's database hold a worker at a
+    time, the others wait on the event loop instead of taking every worker.
+
+    Args:
+        func (callable): Database function to run
+        guild_id (int): Guild the function is called for
+    Returns:
+        The return value of func
+    """
+    key = database_path(guild_id)
+    workers = _guild_workers.get(key)
+    if workers is None:
+        workers = _guild_workers[key] = asyncio.Semaphore(GUILD_WORKERS)
+    async with workers:
+        return await run_in_thread(func, guild_id, *args, **kwargs)
+
+
+async def async_get_names_page(
+    guild_id: int,
+    after: str | None = None,
+    before: str | None = None,
+    limit: int = 20,
+) -> tuple:
+    """Awaitable version of get_names_page."""
+    return await run_in_guild_thread(get_names_page, guild_id, after, before, limit)
+
+
+async def async_get_name_index(guild_id: int) -> NameIndex:
+    """Awaitable version of get_name_index."""
+    return await run_in_guild_thread(get_name_index, guild_id)
+
+
+async def async_add_name(guild_id: int, name: str) -> bool:
+    """Awaitable version of add_name."""
+    return await run_in_guild_thread(add_name, guild_id, name)
+
+
+async def async_remove_name(guild_id: int, name: str) -> bool:
+    """Awaitable version of remove_name."""
+    return await run_in_guild_thread(remove_name, guild_id, name)
+
+
+async def async_get_random_quote(
+    guild_id: int, name: str, channel_id: int | None = None
+) -> tuple:
+    """Awaitable version of get_random_quote."""
+    return await run_in_guild_thread(get_random_quote, guild_id, name, channel_id)
+
+
+async def async_add_quote(guild_id: int, name: str, quote: str) -> AddQuoteResult:
+    """Awaitable version of add_quote."""
+    return await run_in_guild_thread(add_quote, guild_id, name, quote)
+
+
+async def async_get_random_name(guild_id: int, weighted: bool = False) -> str:
+    """Awaitable version of get_random_name."""
+    return await run_in_guild_thread(get_random_name, guild_id, weighted)
+
+
+async def async_flush_scores() -> int:
+    """Awaitable version of flush_scores."""
+    return await run_in_thread(flush_scores)
+
+
+async def async_get_leaderboard(guild_id: int, limit: int = 10) -> list:
+    """Awaitable version of get_leaderboard."""
+    return await run_in_guild_thread(get_leaderboard, guild_id, limit)
+
+
+async def async_search_quotes(
+    guild_id: int, query: str, page: int = 1, per_page: int = 10
+) -> tuple:
+    """Awaitable version of search_quotes."""
+    return await run_in_guild_thread(search_quotes, guild_id, query, page, per_page)
+
+
+async def async_get_timezones(guild_id: int, user_id: int = 0) -> list:
+    """Awaitable version of get_timezones."""
+    return await run_in_guild_thread(get_timezones, guild_id, user_id)
+
+
+async def async_set_timezones(guild_id: int, user_id: int, timezones: list) -> None:
+    """Awaitable version of set_timezones."""
+    return await run_in_guild_thread(set_timezones, guild_id, user_id, timezones)
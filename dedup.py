@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import logging
+
+import database
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Report or remove near duplicate quotes of the same name"
+    )
+    parser.add_argument("action", choices=("report", "merge"))
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.8,
+        help="Similarity from 0 to 1 above which quotes are duplicates",
+    )
+    parser.add_argument(
+        "--guild", type=int, default=0, help="Guild id, defaults to quotes.db"
+    )
+    parser.add_argument(
+        "--guilds-directory",
+        default=database.guilds_directory,
+        help="Directory holding the guild databases",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    database.configure(args.guilds_directory)
+    clusters = database.find_duplicates(args.guild, threshold=args.threshold)
+    for cluster in clusters:
+        print(f"{cluster[0][1]}:")
+        for quote_id, _, quote in cluster:
+            print(f"  {quote_id}: {quote}")
+    duplicates = sum(len(cluster) - 1 for cluster in clusters)
+    module_logger.info(
+        f"Found {len(clusters)} clusters with {duplicates} duplicate quotes"
+    )
+
+    if args.action == "merge":
+        removed = database.merge_duplicates(args.guild, clusters)
+        module_logger.info(f"Removed {removed} quotes, kept the oldest of each")
+
+    database.close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import collections
+import enum
+
+
+class GuessResult(enum.Enum):
+    CORRECT = enum.auto()
+    WRONG = enum.auto()
+    OUT_OF_GUESSES = enum.auto()
+
+
+class Game:
+    """
+    A round of the quote guessing game running in a single channel.
+
+    Args:
+        answer (str): Name the quote is attributed to
+        max_guesses (int): Wrong guesses allowed before the round ends
+    """
+
+    def __init__(self, answer: str, max_guesses: int):
+        self.answer = answer
+        self.guesses_left = max_guesses
+        self.winner = None
+        self.last_guesser = None
+        self.finished = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Wait for the round to be won or run out of guesses.
+
+        Returns:
+            bool: False if the round timed out instead
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                await self.finished.wait()
+            return True
+        except TimeoutError:
+            return False
+
+
+class GameEngine:
+    """
+    Tracks the running game of every channel so a single on_message listener
+    can route guesses to the right game with one dict lookup, instead of each
+    game listening to every message the bot receives. Also keeps a scoreboard
+    of correct guesses per channel.
+    """
+
+    def __init__(self):
+        self.games = {}
+        self.scores = collections.defaultdict(collections.Counter)
+
+    def start(self, channel_id: int, answer: str, max_guesses: int) -> Game | None:
+        """
+        Start a round in a channel.
+
+        Returns:
+            Game | None: The new round, or None if one is already running there
+        """
+        if channel_id in self.games:
+            return None
+        game = Game(answer, max_guesses)
+        self.games[channel_id] = game
+        return game
+
+    def end(self, channel_id: int) -> None:
+        self.games.pop(channel_id, None)
+
+    def guess(self, channel_id: int, user_id: int, content: str) -> GuessResult | None:
+        """
+        Apply a message as a guess to the round running in its channel.
+
+        Returns:
+            GuessResult | None: None if there is no round running in the channel
+        """
+        game = self.games.get(channel_id)
+        if game is None or game.finished.is_set():
+            return None
+
+        game.last_guesser = user_id
+        if content.strip().lower() == game.answer:
+            game.winner = user_id
+            self.scores[channel_id][user_id] += 1
+            game.finished.set()
+            return GuessResult.CORRECT
+
+        game.guesses_left -= 1
+        if game.guesses_left <= 0:
+            game.finished.set()
+            return GuessResult.OUT_OF_GUESSES
+        return GuessResult.WRONG
+
+    def scoreboard(self, channel_id: int, limit: int = 10) -> list:
+        """
+        Returns:
+            list: (user id, correct guesses) tuples, best first
+        """
+        return self.scores[channel_id].most_common(limit)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from config import Config
+from game import GameEngine, GuessResult
+
+ANSWER = "answer"
+
+
+class BroadcastEngine(GameEngine):
+    """
+    Routes a message the way bot.wait_for("message") did, offering it to
+    every running round whose check then compares the channel.
+    """
+
+    def guess(self, channel_id: int, user_id: int, content: str) -> GuessResult | None:
+        for game_channel in list(self.games):
+            if game_channel == channel_id:
+                return super().guess(channel_id, user_id, content)
+        return None
+
+
+async def play(engine: GameEngine, channel_id: int, rounds: list) -> None:
+    """Play rounds in a channel back to back, like players restarting them."""
+    while True:
+        game = engine.start(channel_id, ANSWER, Config.game_max_guesses)
+        try:
+            won = await game.wait(Config.game_timeout)
+        finally:
+            engine.end(channel_id)
+        rounds.append("won" if won and game.winner else "lost" if won else "timeout")
+
+
+async def run(engine: GameEngine, args: argparse.Namespace) -> tuple:
+    """
+    Send messages to random channels, some running a game and most not, and
+    route each one through the engine like on_message does.
+
+    Returns:
+        tuple: Microseconds each message took to route and the outcome of
+        every finished round
+    """
+    rounds = []
+    players = [
+        asyncio.create_task(play(engine, channel_id, rounds))
+        for channel_id in range(args.games)
+    ]
+    await asyncio.sleep(0)
+    channels = args.games + args.idle_channels
+    timings = []
+    for _ in range(args.messages):
+        channel_id = random.randrange(channels)
+        content = ANSWER if random.random() < args.correct else "wrong"
+        started = time.perf_counter()
+        engine.guess(channel_id, random.randrange(100), content)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+        # Let the rounds that just finished start their next one
+        await asyncio.sleep(0)
+    for player in players:
+        player.cancel()
+    await asyncio.gather(*players, return_exceptions=True)
+    return timings, rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load test the quote game engine with many simultaneous games"
+    )
+    parser.add_argument("--games", type=int, default=500, help="Channels playing")
+    parser.add_argument(
+        "--idle-channels",
+        type=int,
+        default=2000,
+        help="Channels that only chat, their messages are never guesses",
+    )
+    parser.add_argument(
+        "--messages", type=int, default=20_000, help="Messages to route"
+    )
+    parser.add_argument(
+        "--correct", type=float, default=0.05, help="Share of correct guesses"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    if args.messages < 2:
+        parser.error("--messages must be at least 2")
+
+    print(
+        f"games={args.games} idle_channels={args.idle_channels} "
+        f"messages={args.messages} max_guesses={Config.game_max_guesses}"
+    )
+    for mode, engine in (("broadcast", BroadcastEngine()), ("engine", GameEngine())):
+        random.seed(args.seed)
+        started = time.perf_counter()
+        timings, rounds = asyncio.run(run(engine, args))
+        elapsed = time.perf_counter() - started
+        percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+        print(
+            f"{mode:<9}  p50 {percentiles[49]:.1f}us  p99 {percentiles[98]:.1f}us  "
+            f"routing {sum(timings) / 1000:.0f}ms  total {elapsed * 1000:.0f}ms  "
+            f"rounds won {rounds.count('won')} lost {rounds.count('lost')}"
+        )
+
+
+if __name__ == "__main__":
+    main()
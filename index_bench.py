@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import random
+import statistics
+import string
+import time
+
+from indexes import NameIndex
+
+# Open and closed syllables like "ka" and "kan", names made of them share
+# trigrams about as often as real names do
+SYLLABLES = [
+    consonant + vowel + coda
+    for consonant in "bcdfghjklmnprstvwz"
+    for vowel in "aeiou"
+    for coda in ("", "n", "r", "l", "s")
+]
+
+
+def make_names(count: int) -> list:
+    names = set()
+    while len(names) < count:
+        first = "".join(random.choices(SYLLABLES, k=random.randint(2, 3)))
+        last = "".join(random.choices(SYLLABLES, k=random.randint(2, 4)))
+        names.add(f"{first} {last}")
+    return list(names)
+
+
+def make_queries(names: list, kind: str, count: int) -> list:
+    """
+    Build autocomplete input as it is typed: the start of a name, a slice
+    from its middle or a whole name with one typo.
+    """
+    queries = []
+    for name in random.choices(names, k=count):
+        if kind == "prefix":
+            queries.append(name[: random.randint(1, 5)])
+        elif kind == "substring":
+            start = random.randint(1, len(name) - 3)
+            queries.append(name[start : start + random.randint(3, 6)])
+        else:
+            i = random.randrange(len(name))
+            queries.append(
+                name[:i] + random.choice(string.ascii_lowercase) + name[i + 1 :]
+            )
+    return queries
+
+
+def linear_search(names: list, query: str, limit: int = 25) -> list:
+    """The autocomplete callbacks before the name index."""
+    return [name for name in names if query in name.lower()][:limit]
+
+
+def benchmark(search, queries: list) -> list:
+    """
+    Returns:
+        list: Microseconds each search took
+    """
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare NameIndex autocomplete search with a linear scan"
+    )
+    parser.add_argument("--names", type=int, default=100_000, help="Names to index")
+    parser.add_argument("--runs", type=int, default=1000, help="Searches per kind")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    if args.runs < 2:
+        parser.error("--runs must be at least 2")
+    random.seed(args.seed)
+
+    names = make_names(args.names)
+    started = time.perf_counter()
+    index = NameIndex(names)
+    print(
+        f"names={args.names} runs={args.runs}, "
+        f"index built in {(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+    names.sort()
+    for kind in ("prefix", "substring", "typo"):
+        queries = make_queries(names, kind, args.runs)
+        for mode, search in (
+            ("linear", lambda query: linear_search(names, query)),
+            ("index", index.search),
+        ):
+            timings = benchmark(search, queries)
+            percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+            print(
+                f"{kind:<9}  {mode:<6}  p50 {percentiles[49]:.0f}us  "
+                f"p99 {percentiles[98]:.0f}us  max {max(timings):.0f}us"
+            )
+
+
+if __name__ == "__main__":
+    main()
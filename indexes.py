@@ -0,0 +1,510 @@
+# SPDX-FileCopyrightText: 2023 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import bisect
+import collections
+import hashlib
+import heapq
+import random
+import re
+import struct
+import threading
+import unicodedata
+
+
+class WeightTree:
+    """
+    Fenwick tree over a list of integer weights, used to pick a random
+    position with probability proportional to its weight. Changing a weight
+    and picking are O(log n), positions can be appended and the last one
+    removed so it can follow a list kept compact by swapping removals.
+
+    Args:
+        weights (list): Initial non-negative weights
+    """
+
+    def __init__(self, weights: list | None = None):
+        self._weights = list(weights or ())
+        self._tree = [0, *self._weights]
+        self.total = sum(self._weights)
+        size = len(self._weights)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def __getitem__(self, position: int) -> int:
+        return self._weights[position]
+
+    def _prefix(self, end: int) -> int:
+        total = 0
+        while end > 0:
+            total += self._tree[end]
+            end -= end & -end
+        return total
+
+    def add(self, position: int, delta: int) -> None:
+        self._weights[position] += delta
+        self.total += delta
+        i = position + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def append(self, weight: int) -> None:
+        self._weights.append(weight)
+        self.total += weight
+        size = len(self._weights)
+        # The new node covers the weights from size - lowbit(size) + 1 to size
+        self._tree.append(
+            weight + self._prefix(size - 1) - self._prefix(size - (size & -size))
+        )
+
+    def pop(self) -> int:
+        # Only nodes after the last position include its weight
+        self._tree.pop()
+        weight = self._weights.pop()
+        self.total -= weight
+        return weight
+
+    def sample(self) -> int | None:
+        """
+        Returns:
+            int: Random position weighted by its weight, None if every weight
+            is 0
+        """
+        if self.total <= 0:
+            return None
+        remaining = random.randrange(self.total)
+        position = 0
+        step = 1 << (len(self._weights).bit_length() - 1)
+        while step:
+            node = position + step
+            if node < len(self._tree) and self._tree[node] <= remaining:
+                position = node
+                remaining -= self._tree[node]
+            step >>= 1
+        return position
+
+
+class QuoteIndex:
+    """
+    In-memory index of the people and quote ids in the database used to pick
+    random names and quotes in constant time. Every list is paired with a
+    position lookup so entries can be removed by swapping with the last
+    element instead of shifting the whole list. Names can also be picked
+    weighted by their number of quotes, and quotes drawn from per channel
+    shuffle bags so a channel sees every quote of a name before any repeats.
+    Only the most recently used bags are kept.
+    """
+
+    max_bags = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._names = []
+        self._name_positions = {}
+        self._weights = WeightTree()
+        self._quote_ids = {}
+        self._quote_positions = {}
+        self._bags = collections.OrderedDict()
+
+    def load(self, names: list, quotes: list) -> None:
+        """
+        Replace the contents of the index.
+
+        Args:
+            names (list): Every name in the people table
+            quotes (list): (id, name) tuples for every row in the quotes table
+        """
+        with self._lock:
+            self._names = list(names)
+            self._name_positions = {name: i for i, name in enumerate(self._names)}
+            self._quote_ids = {name: [] for name in self._names}
+            self._quote_positions = {}
+            for quote_id, name in quotes:
+                ids = self._quote_ids.setdefault(name, [])
+                self._quote_positions[quote_id] = len(ids)
+                ids.append(quote_id)
+            self._weights = WeightTree(
+                [len(self._quote_ids[name]) for name in self._names]
+            )
+            self._bags.clear()
+            self.loaded = True
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._name_positions
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    # Changes made before the first load are dropped, load reads them from
+    # the database anyway and a partial index must never be used to pick
+    def add_name(self, name: str) -> None:
+        with self._lock:
+            if not self.loaded or name in self._name_positions:
+                return
+            self._name_positions[name] = len(self._names)
+            self._names.append(name)
+            self._weights.append(len(self._quote_ids.setdefault(name, [])))
+
+    def remove_name(self, name: str) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            position = self._name_positions.pop(name, None)
+            if position is not None:
+                last = self._names.pop()
+                if last != name:
+                    self._names[position] = last
+                    self._name_positions[last] = position
+                    self._weights.add(
+                        position, self._weights[-1] - self._weights[position]
+                    )
+                self._weights.pop()
+            for quote_id in self._quote_ids.pop(name, []):
+                self._quote_positions.pop(quote_id, None)
+
+    def add_quote(self, name: str, quote_id: int) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            ids = self._quote_ids.setdefault(name, [])
+            self._quote_positions[quote_id] = len(ids)
+            ids.append(quote_id)
+            if name in self._name_positions:
+                self._weights.add(self._name_positions[name], 1)
+
+    def remove_quote(self, name: str, quote_id: int) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            position = self._quote_positions.pop(quote_id, None)
+            ids = self._quote_ids.get(name)
+            if position is None or ids is None:
+                return
+            last = ids.pop()
+            if last != quote_id:
+                ids[position] = last
+                self._quote_positions[last] = position
+            if name in self._name_positions:
+                self._weights.add(self._name_positions[name], -1)
+
+    def random_name(self, weighted: bool = False) -> str:
+        """
+        Args:
+            weighted (bool): Pick names in proportion to their number of
+                quotes, names without quotes are only picked if none have any
+        Raises:
+            IndexError: The index has no names
+        """
+        if weighted:
+            with self._lock:
+                position = self._weights.sample()
+                if position is not None:
+                    return self._names[position]
+        return random.choice(self._names)
+
+    def random_quote_id(self, name: str, bag: int | None = None) -> int | None:
+        """
+        Args:
+            name (str): Name to pick one of the quotes of
+            bag (int): Draw from this shuffle bag, usually a channel id,
+                instead of picking with replacement
+        Returns:
+            int: Quote id, None if the name has no quotes
+        """
+        ids = self._quote_ids.get(name)
+        if not ids:
+            return None
+        if bag is None:
+            return random.choice(ids)
+        key = (bag, name)
+        with self._lock:
+            remaining = self._bags.pop(key, None)
+            if not remaining:
+                remaining = list(ids)
+                random.shuffle(remaining)
+            quote_id = remaining.pop()
+            if remaining:
+                self._bags[key] = remaining
+                if len(self._bags) > self.max_bags:
+                    self._bags.popitem(last=False)
+            return quote_id
+
+
+class NameIndex:
+    """
+    In-memory search index over names used for autocomplete. Prefix matches
+    come from a sorted list of lowercased keys with bisect, substring matches
+    from an n-gram index of every 1 to 3 character slice of each key.
+    """
+
+    gram_size = 3
+
+    def __init__(self, names: list | None = None):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._names = {}
+        self._grams = {}
+        if names:
+            self.load(names)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._names
+
+    def _key_grams(self, key: str) -> set:
+        return {
+            key[i : i + n]
+            for n in range(1, self.gram_size + 1)
+            for i in range(len(key) - n + 1)
+        }
+
+    def _index(self, key: str) -> None:
+        for gram in self._key_grams(key):
+            self._grams.setdefault(gram, set()).add(key)
+
+    def load(self, names: list) -> None:
+        """
+        Replace the contents of the index.
+
+        Args:
+            names (list): Names to index
+        """
+        with self._lock:
+            self._names = {name.lower(): name for name in names}
+            self._keys = sorted(self._names)
+            self._grams = {}
+            for key in self._keys:
+                self._index(key)
+
+    def add(self, name: str) -> None:
+        key = name.lower()
+        with self._lock:
+            if key in self._names:
+                return
+            self._names[key] = name
+            bisect.insort(self._keys, key)
+            self._index(key)
+
+    def remove(self, name: str) -> None:
+        key = name.lower()
+        with self._lock:
+            if self._names.pop(key, None) is None:
+                return
+            del self._keys[bisect.bisect_left(self._keys, key)]
+            for gram in self._key_grams(key):
+                keys = self._grams.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._grams[gram]
+
+    def _prefix(self, query: str, limit: int) -> list:
+        start = bisect.bisect_left(self._keys, query)
+        matches = []
+        for key in self._keys[start : start + limit]:
+            if not key.startswith(query):
+                break
+            matches.append(key)
+        return matches
+
+    def _substring(self, query: str) -> set:
+        if len(query) <= self.gram_size:
+            return self._grams.get(query, set())
+        grams = sorted(
+            (
+                self._grams.get(query[i : i + self.gram_size], set())
+                for i in range(len(query) - self.gram_size + 1)
+            ),
+            key=len,
+        )
+        return {key for key in grams[0] if query in key}
+
+    def _fuzzy(self, query: str) -> dict:
+        hits = {}
+        for i in range(len(query) - self.gram_size + 1):
+            for key in self._grams.get(query[i : i + self.gram_size], ()):
+                hits[key] = hits.get(key, 0) + 1
+        threshold = max(1, (len(query) - self.gram_size + 1) // 2)
+        return {key: count for key, count in hits.items() if count >= threshold}
+
+    def search(self, query: str, limit: int = 25) -> list:
+        """
+        Return up to limit names matching the query ranked by exact match,
+        prefix matches, substring matches by match position and finally
+        names that share most of the query's trigrams.
+
+        Args:
+            query (str): User input to match
+            limit (int): Maximum number of names to return
+        Returns:
+            list: Matching names
+        """
+        query = query.lower()
+        with self._lock:
+            if not query:
+                return [self._names[key] for key in self._keys[:limit]]
+
+            results = self._prefix(query, limit)
+            if len(results) < limit:
+                seen = set(results)
+                substring = self._substring(query) - seen
+                results += heapq.nsmallest(
+                    limit - len(results),
+                    substring,
+                    key=lambda key: (key.find(query), key),
+                )
+            if len(results) < limit and len(query) > self.gram_size:
+                seen = set(results)
+                fuzzy = {k: c for k, c in self._fuzzy(query).items() if k not in seen}
+                results += heapq.nsmallest(
+                    limit - len(results),
+                    fuzzy,
+                    key=lambda key: (-fuzzy[key], key),
+                )
+            return [self._names[key] for key in results]
+
+
+def normalize_quote(text: str) -> str:
+    """
+    Reduce a quote to the form duplicates are compared in, case folded with
+    punctuation removed and whitespace collapsed. A quote made only of emoji
+    or punctuation keeps them, otherwise every such quote would be the same.
+    Check with python -m doctest indexes.py:
+
+    >>> normalize_quote("Hello,  WORLD!")
+    'hello world'
+    >>> normalize_quote("🔥"), normalize_quote(":)") == normalize_quote(":(")
+    ('🔥', False)
+    >>> quote_hash("😂") == quote_hash("🔥")
+    False
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split()) or " ".join(text.split())
+
+
+def quote_hash(text: str) -> bytes:
+    """Hash of the normalized quote, equal for exact duplicates."""
+    return hashlib.blake2b(normalize_quote(text).encode(), digest_size=16).digest()
+
+
+def shingles(normalized: str, size: int = 4) -> set:
+    return {normalized[i : i + size] for i in range(max(len(normalized) - size + 1, 1))}
+
+
+class NearDuplicateIndex:
+    """
+    MinHash locality sensitive hashing index used to find quotes that are
+    nearly the same as another quote of the same name. Every quote gets a
+    signature of the smallest hash of its character shingles under 32 hash
+    functions, which are the words of two differently personalized blake2b
+    digests. The signature is split into 8 bands of 4 words and quotes
+    sharing a band with the same name are candidates, which catches about
+    98% of pairs at 0.8 similarity and few below 0.5. Only candidates are
+    compared by their actual shingle overlap, so finding duplicates never
+    compares every pair.
+
+    Args:
+        threshold (float): Jaccard similarity of the shingles above which
+            two quotes are near duplicates
+    """
+
+    num_perm = 32
+    bands = 8
+    _digest = struct.Struct("<16I")
+    _signature = struct.Struct(f"<{num_perm}I")
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._entries = {}
+        self._names = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @classmethod
+    def signature(cls, text: str) -> bytes:
+        """
+        Returns:
+            bytes: Packed MinHash signature of the quote
+        """
+        words = []
+        for person in (b"", b"minhash"):
+            rows = [
+                cls._digest.unpack(
+                    hashlib.blake2b(shingle.encode(), person=person).digest()
+                )
+                for shingle in shingles(normalize_quote(text))
+            ]
+            words += map(min, zip(*rows, strict=True))
+        return cls._signature.pack(*words)
+
+    def _band_keys(self, name: str, signature: bytes) -> list:
+        width = len(signature) // self.bands
+        return [
+            (band, name, signature[band * width : (band + 1) * width])
+            for band in range(self.bands)
+        ]
+
+    def add(self, quote_id: int, name: str, text: str, signature: bytes) -> None:
+        with self._lock:
+            self._entries[quote_id] = (name, normalize_quote(text), signature)
+            self._names.setdefault(name, set()).add(quote_id)
+            for key in self._band_keys(name, signature):
+                self._buckets.setdefault(key, set()).add(quote_id)
+
+    def _remove(self, quote_id: int) -> None:
+        entry = self._entries.pop(quote_id, None)
+        if entry is None:
+            return
+        name, _, signature = entry
+        self._names.get(name, set()).discard(quote_id)
+        for key in self._band_keys(name, signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(quote_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def remove(self, quote_id: int) -> None:
+        with self._lock:
+            self._remove(quote_id)
+
+    def remove_name(self, name: str) -> None:
+        with self._lock:
+            for quote_id in self._names.pop(name, set()):
+                self._remove(quote_id)
+
+    def similar(self, name: str, text: str, signature: bytes) -> list:
+        """
+        Find the quotes of a name that are near duplicates of a quote.
+
+        Args:
+            name (str): Name the quote is attributed to
+            text (str): The quote
+            signature (bytes): Signature of the quote
+        Returns:
+            list: Ids of the near duplicate quotes, most similar first
+        """
+        quote_shingles = shingles(normalize_quote(text))
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(name, signature):
+                candidates |= self._buckets.get(key, set())
+            matches = []
+            for quote_id in candidates:
+                other = shingles(self._entries[quote_id][1])
+                similarity = len(quote_shingles & other) / len(quote_shingles | other)
+                if similarity >= self.threshold:
+                    matches.append((similarity, quote_id))
+        return [quote_id for _, quote_id in sorted(matches, reverse=True)]
@@ -0,0 +1,152 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+log_format = "[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s"
+date_format = "%Y-%m-%d %H:%M:%S"
+
+
+class SizedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    Rotates the log file on a schedule like TimedRotatingFileHandler and also
+    whenever it grows past max_bytes, keeping backup_count old files.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            message = f"{self.format(record)}\n"
+            return self.stream.tell() + len(message) >= self.max_bytes
+        return False
+
+    def getFilesToDelete(self) -> list:
+        # Match on the base name since numbered rollovers don't fit the
+        # date suffix pattern the parent class looks for
+        directory, base_name = os.path.split(self.baseFilename)
+        rotated = sorted(
+            (
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name.startswith(f"{base_name}.")
+            ),
+            key=os.path.getmtime,
+        )
+        return rotated[: max(len(rotated) - self.backupCount, 0)]
+
+    def rotation_filename(self, default_name: str) -> str:
+        # Size based rollovers can happen more than once in the same time
+        # period, number them so they don't overwrite each other
+        name, counter = default_name, 1
+        while os.path.exists(name):
+            name = f"{default_name}.{counter}"
+            counter += 1
+        return name
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, date_format),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through only a fraction of DEBUG records so verbose logging can stay
+    on under load, every other level always passes.
+
+    Args:
+        rate (float): Fraction of DEBUG records to keep between 0 and 1
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+def setup_logging(
+    level: int,
+    directory: str = "logs",
+    json_format: bool = False,
+    max_bytes: int = 0,
+    backup_count: int = 0,
+    when: str = "midnight",
+    debug_sample_rate: float = 1.0,
+) -> logging.handlers.QueueListener:
+    """
+    Route every log record through a queue so that the console and file
+    writes happen on a background thread instead of the event loop.
+
+    Args:
+        level (int): Root log level
+        directory (str): Directory for the log file
+        json_format (bool): Write the log file as JSON lines
+        max_bytes (int): Rotate the log file once it reaches this size, 0 to
+            only rotate on schedule
+        backup_count (int): Number of rotated files to keep, 0 keeps all
+        when (str): TimedRotatingFileHandler rotation schedule
+        debug_sample_rate (float): Fraction of DEBUG records to keep
+    Returns:
+        QueueListener: Started listener, stop it before exiting to flush logs
+    """
+    logger = logging.getLogger(f"__main__.{__name__}")
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        logger.info(f"{directory} directory could not be created")
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(log_format, datefmt=date_format))
+    file_handler = SizedTimedRotatingFileHandler(
+        os.path.join(directory, "bot.log"),
+        max_bytes=max_bytes,
+        when=when,
+        backupCount=backup_count,
+        encoding="utf-8",
+    )
+    if json_format:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(log_format, datefmt=date_format))
+    # Only the bot's own loggers go to the file, library logs stay on the console
+    file_handler.addFilter(logging.Filter("__main__"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
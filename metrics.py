@@ -0,0 +1,248 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+# Upper bounds in seconds, the last bucket catches everything slower
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_descriptions = {}
+
+
+class Histogram:
+    """
+    Fixed bucket latency histogram in the same shape Prometheus expects.
+
+    Args:
+        buckets (tuple): Sorted bucket upper bounds in seconds
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): Quantile between 0 and 1
+        Returns:
+            float: Estimated value in seconds, inf if it's past the last bucket
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts, strict=False):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def describe(name: str, description: str) -> None:
+    """Set the HELP text shown for a metric on the Prometheus endpoint."""
+    _descriptions[name] = description
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """
+    Record a value in seconds in the histogram for name and labels.
+
+    Args:
+        name (str): Metric name
+        value (float): Observed value in seconds
+    """
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        key = _labels_key(labels)
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+
+def increment(name: str, amount: float = 1, **labels) -> None:
+    """
+    Add to the counter for name and labels.
+
+    Args:
+        name (str): Metric name
+        amount (float): Amount to add
+    """
+    with _lock:
+        series = _counters.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + amount
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels):
+    """
+    Time the body of a with block and record it in a histogram. Works inside
+    coroutines as well since it only reads the clock on entry and exit.
+
+    Args:
+        name (str): Metric name
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def histograms(name: str) -> dict:
+    """Return a snapshot of every histogram recorded under name by labels."""
+    with _lock:
+        return {
+            key: _copy_histogram(histogram)
+            for key, histogram in _histograms.get(name, {}).items()
+        }
+
+
+def counters(name: str) -> dict:
+    """Return a snapshot of every counter recorded under name by labels."""
+    with _lock:
+        return dict(_counters.get(name, {}))
+
+
+def _copy_histogram(histogram: Histogram) -> Histogram:
+    copy = Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    copy.count = histogram.count
+    return copy
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: Metrics page
+    """
+    lines = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            if name in _descriptions:
+                lines.append(f"# HELP {name} {_descriptions[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(_histograms.items()):
+            if name in _descriptions:
+                lines.append(f"# HELP {name} {_descriptions[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(
+                    (*histogram.buckets, "+Inf"), histogram.counts, strict=True
+                ):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_format_labels(key, (('le', bound),))} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """
+    Measure how late the event loop wakes up from a sleep, which is how long
+    something blocked it, and record it as event_loop_lag_seconds forever.
+
+    Args:
+        interval (float): Seconds between measurements
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        observe(
+            "event_loop_lag_seconds",
+            max(time.perf_counter() - started - interval, 0.0),
+        )
+
+
+async def start_http_server(host: str, port: int):
+    """
+    Serve the metrics page at /metrics for Prometheus to scrape.
+
+    Args:
+        host (str): Address to bind, keep it local unless a scraper needs it
+        port (int): Port to bind
+    Returns:
+        aiohttp.web.AppRunner: Runner to clean up the server with
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    module_logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+    return runner
+
+
+describe("command_latency_seconds", "Time spent handling a command")
+describe("database_query_seconds", "Time spent running a database function")
+describe("database_queue_seconds", "Time a database call waited for a worker")
+describe("database_migration_seconds", "Time spent applying a schema migration")
+describe("status_probe_seconds", "Time spent on each stage of a server probe")
+describe("backup_seconds", "Time spent on each stage of a database backup")
+describe("startup_seconds", "Time from process start until the bot was ready")
+describe("event_loop_lag_seconds", "How late the event loop woke up from a sleep")
+describe("cache_requests_total", "Cache lookups by cache and result")
+describe("rate_limited_total", "Command uses rejected by a rate limit")
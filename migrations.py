@@ -0,0 +1,326 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import logging
+import sqlite3
+import time
+
+import metrics
+from indexes import NearDuplicateIndex, quote_hash
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+QUOTES_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS quotes_fts_insert AFTER INSERT ON quotes
+    BEGIN
+        INSERT INTO quotes_fts(rowid, quote, name)
+        VALUES (new.id, new.quote, new.name);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS quotes_fts_delete AFTER DELETE ON quotes
+    BEGIN
+        INSERT INTO quotes_fts(quotes_fts, rowid, quote, name)
+        VALUES ('delete', old.id, old.quote, old.name);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS quotes_fts_update
+    AFTER UPDATE OF name, quote ON quotes
+    BEGIN
+        INSERT INTO quotes_fts(quotes_fts, rowid, quote, name)
+        VALUES ('delete', old.id, old.quote, old.name);
+        INSERT INTO quotes_fts(rowid, quote, name)
+        VALUES (new.id, new.quote, new.name);
+    END;""",
+)
+
+# Every change to the people and quotes tables bumps the version in the
+# changes table, whichever connection or process made it
+CHANGES_TRIGGERS = tuple(
+    f"""CREATE TRIGGER IF NOT EXISTS {table}_{event.split()[0].lower()}_changes
+    AFTER {event} ON {table}
+    BEGIN
+        UPDATE changes SET version = version + 1;
+    END;"""
+    for table, event in (
+        ("people", "INSERT"),
+        ("people", "DELETE"),
+        ("people", "UPDATE OF name"),
+        ("quotes", "INSERT"),
+        ("quotes", "DELETE"),
+        ("quotes", "UPDATE OF name, quote"),
+    )
+)
+
+
+def create_people_and_quotes(cursor: sqlite3.Cursor) -> None:
+    """
+    The people table contains one column "name". Each record under "name"
+    must be unique. The quotes table contains the columns' id, name, and
+    quote. The ID column must be unique. The name column is a foreign key to
+    the name column in the people table.
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS people(
+            'name' TEXT NOT NULL UNIQUE
+        );"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS quotes(
+            'id' INTEGER NOT NULL UNIQUE,
+            'name' TEXT NOT NULL,
+            'quote' TEXT NOT NULL,
+            FOREIGN KEY('name')
+            REFERENCES 'people'('name'),
+            PRIMARY KEY('id' AUTOINCREMENT)
+        );"""
+    )
+
+
+def create_quotes_name_index(cursor: sqlite3.Cursor) -> None:
+    """Index quotes by name so lookups by name don't scan the whole table."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS quotes_name_idx ON quotes(name);")
+
+
+def create_quotes_fts(cursor: sqlite3.Cursor) -> None:
+    """
+    The quotes_fts table is an FTS5 full-text index over the quotes table
+    kept in sync with triggers.
+    """
+    cursor.execute(
+        """CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts
+        USING fts5(
+            quote,
+            name UNINDEXED,
+            content='quotes',
+            content_rowid='id'
+        );"""
+    )
+    for trigger in QUOTES_FTS_TRIGGERS:
+        cursor.execute(trigger)
+    # Index quotes recorded before full-text search existed
+    cursor.execute("INSERT INTO quotes_fts(quotes_fts) VALUES ('rebuild')")
+
+
+def create_scores(cursor: sqlite3.Cursor) -> None:
+    """The scores table holds the guessing game results of every user."""
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS scores(
+            'guild_id' INTEGER NOT NULL,
+            'user_id' INTEGER NOT NULL,
+            'correct' INTEGER NOT NULL DEFAULT 0,
+            'wrong' INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY('guild_id', 'user_id')
+        );"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS scores_ranking_idx
+        ON scores(guild_id, correct DESC);"""
+    )
+
+
+def cascade_quotes_delete(cursor: sqlite3.Cursor) -> None:
+    """
+    Rebuild the quotes table so removing a name also removes its quotes.
+    SQLite can't alter a foreign key in place, so the rows are copied into a
+    new table that replaces the old one. Quotes whose name was missing from
+    the people table get their name added back.
+    """
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'quotes'")
+    sequence = cursor.fetchone()
+    cursor.execute(
+        """CREATE TABLE quotes_new(
+            'id' INTEGER NOT NULL UNIQUE,
+            'name' TEXT NOT NULL,
+            'quote' TEXT NOT NULL,
+            FOREIGN KEY('name')
+            REFERENCES 'people'('name') ON DELETE CASCADE,
+            PRIMARY KEY('id' AUTOINCREMENT)
+        );"""
+    )
+    cursor.execute("INSERT OR IGNORE INTO people ('name') SELECT name FROM quotes")
+    cursor.execute("INSERT INTO quotes_new SELECT id, name, quote FROM quotes")
+    # Dropping the table drops its index and full-text triggers with it, the
+    # full-text rows stay valid since the ids are kept
+    cursor.execute("DROP TABLE quotes")
+    cursor.execute("ALTER TABLE quotes_new RENAME TO quotes")
+    create_quotes_name_index(cursor)
+    for trigger in QUOTES_FTS_TRIGGERS:
+        cursor.execute(trigger)
+    if sequence is not None:
+        # Keep AUTOINCREMENT from reusing the ids of quotes deleted before
+        cursor.execute(
+            "UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'quotes'",
+            sequence,
+        )
+
+
+def create_timezones(cursor: sqlite3.Cursor) -> None:
+    """
+    The timezones table holds the timezone lists shown by the time command
+    for a guild (user_id 0) or a user (guild_id 0), in display order.
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS timezones(
+            'guild_id' INTEGER NOT NULL,
+            'user_id' INTEGER NOT NULL,
+            'position' INTEGER NOT NULL,
+            'timezone' TEXT NOT NULL,
+            PRIMARY KEY('guild_id', 'user_id', 'position')
+        );"""
+    )
+
+
+def hash_quotes(cursor: sqlite3.Cursor) -> None:
+    """
+    Add the normalized text hash and MinHash signature of every quote, used
+    to reject exact and near duplicate quotes. Exact duplicates that already
+    exist are kept but left without a hash, so the hash can be unique per
+    name, and logged for review with dedup.py. The unique index starts with
+    name and replaces quotes_name_idx.
+    """
+    cursor.execute("ALTER TABLE quotes ADD COLUMN 'quote_hash' BLOB")
+    cursor.execute("ALTER TABLE quotes ADD COLUMN 'minhash' BLOB")
+    # Only changes to the name or quote need to reach the full-text index,
+    # filling in the new columns shouldn't rewrite it
+    cursor.execute("DROP TRIGGER IF EXISTS quotes_fts_update")
+    for trigger in QUOTES_FTS_TRIGGERS:
+        cursor.execute(trigger)
+    cursor.execute("SELECT id, quote FROM quotes")
+    cursor.executemany(
+        "UPDATE quotes SET quote_hash = ?, minhash = ? WHERE id = ?",
+        [
+            (quote_hash(quote), NearDuplicateIndex.signature(quote), quote_id)
+            for quote_id, quote in cursor.fetchall()
+        ],
+    )
+    cursor.execute(
+        """UPDATE quotes SET quote_hash = NULL WHERE id NOT IN (
+            SELECT min(id) FROM quotes GROUP BY name, quote_hash
+        )
+        RETURNING id, name, quote"""
+    )
+    if duplicates := cursor.fetchall():
+        for quote_id, name, quote in duplicates:
+            module_logger.info(f"Quote {quote_id} of {name} is a duplicate: {quote}")
+        module_logger.warning(
+            f"Found {len(duplicates)} duplicate quotes, review and remove them "
+            "with dedup.py merge"
+        )
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS quotes_hash_idx ON quotes(name, quote_hash)"
+    )
+    cursor.execute("DROP INDEX IF EXISTS quotes_name_idx")
+
+
+def rehash_symbol_quotes(cursor: sqlite3.Cursor) -> None:
+    """
+    Quotes made only of emoji or punctuation used to normalize to an empty
+    string, so they all shared one hash and hash_quotes could take them for
+    duplicates of each other. Hash them and the quotes left without a hash
+    again. Rows are rehashed oldest first and a hash another quote of the
+    name already has is left out, so real duplicates stay without one.
+    """
+    cursor.execute(
+        """SELECT id, quote FROM quotes
+        WHERE quote_hash IS NULL OR quote_hash = ? ORDER BY id""",
+        # Hash every one of those quotes had
+        (quote_hash(""),),
+    )
+    rows = cursor.fetchall()
+    cursor.executemany(
+        "UPDATE quotes SET quote_hash = NULL, minhash = ? WHERE id = ?",
+        [(NearDuplicateIndex.signature(quote), quote_id) for quote_id, quote in rows],
+    )
+    cursor.executemany(
+        "UPDATE OR IGNORE quotes SET quote_hash = ? WHERE id = ?",
+        [(quote_hash(quote), quote_id) for quote_id, quote in rows],
+    )
+    cursor.execute("SELECT count(*) FROM quotes WHERE quote_hash IS NULL")
+    if duplicates := cursor.fetchone()[0]:
+        module_logger.warning(
+            f"{duplicates} duplicate quotes are left without a hash, review and "
+            "remove them with dedup.py merge"
+        )
+
+
+def count_changes(cursor: sqlite3.Cursor) -> None:
+    """
+    The changes table holds a single version number that triggers bump on
+    every change to the people and quotes tables. It tells whether the
+    in-memory indexes still match the database from any connection.
+    """
+    cursor.execute("CREATE TABLE IF NOT EXISTS changes('version' INTEGER NOT NULL);")
+    cursor.execute("INSERT INTO changes ('version') VALUES (0)")
+    for trigger in CHANGES_TRIGGERS:
+        cursor.execute(trigger)
+
+
+# Applied in order, a database's PRAGMA user_version is the number of
+# migrations it has. Only ever append to this list.
+MIGRATIONS = (
+    create_people_and_quotes,
+    create_quotes_name_index,
+    create_quotes_fts,
+    create_scores,
+    cascade_quotes_delete,
+    create_timezones,
+    hash_quotes,
+    rehash_symbol_quotes,
+    count_changes,
+)
+
+
+def migrate(conn: sqlite3.Connection, path: str) -> int:
+    """
+    Apply the migrations a database doesn't have yet. Every migration runs in
+    its own transaction with foreign keys checked before it commits, so a
+    failed migration leaves the database at the previous version.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database, no transaction
+            may be open on it
+        path (str): Database filepath, used in log messages
+    Returns:
+        int: Number of migrations applied
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > len(MIGRATIONS):
+        raise RuntimeError(
+            f"{path} is at schema version {version}, newer than this bot "
+            f"supports ({len(MIGRATIONS)})"
+        )
+
+    pending = MIGRATIONS[version:]
+    for number, migration in enumerate(pending, start=version + 1):
+        started = time.perf_counter()
+        # Foreign keys can only be toggled outside of a transaction, they are
+        # checked by foreign_key_check before committing instead
+        conn.execute("PRAGMA foreign_keys=OFF")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+            # Older databases can already have orphaned rows, only fail on
+            # the ones the migration introduced
+            cursor.execute("PRAGMA foreign_key_check")
+            existing = set(cursor.fetchall())
+            migration(cursor)
+            cursor.execute("PRAGMA foreign_key_check")
+            if violations := set(cursor.fetchall()) - existing:
+                raise sqlite3.IntegrityError(
+                    f"Migration {migration.__name__} broke foreign keys: "
+                    f"{sorted(violations)[:5]}"
+                )
+            cursor.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("PRAGMA foreign_keys=ON")
+        elapsed = time.perf_counter() - started
+        metrics.observe(
+            "database_migration_seconds", elapsed, migration=migration.__name__
+        )
+        module_logger.info(
+            f"Applied migration {number} {migration.__name__} to {path} "
+            f"in {elapsed * 1000:.1f}ms"
+        )
+    return len(pending)
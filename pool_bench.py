@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import logging
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import database
+
+GUILD_ID = 1
+
+
+def reconnect_access(path: str, name: str) -> None:
+    """
+    The access command as it ran before the connection pool, verify_name and
+    get_random_quote each connecting, committing and closing.
+    """
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(name) FROM people WHERE name=?", (name,))
+    cursor.fetchone()
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT quote FROM quotes WHERE name=? ORDER BY RANDOM() LIMIT 1", (name,)
+    )
+    cursor.fetchone()
+    conn.commit()
+    conn.close()
+
+
+def pooled_access(path: str, name: str) -> None:
+    """The same two queries on connections borrowed from the pool."""
+    with database.OpenDatabase(path) as cursor:
+        cursor.execute("SELECT count(name) FROM people WHERE name=?", (name,))
+        cursor.fetchone()
+    with database.OpenDatabase(path) as cursor:
+        cursor.execute(
+            "SELECT quote FROM quotes WHERE name=? ORDER BY RANDOM() LIMIT 1",
+            (name,),
+        )
+        cursor.fetchone()
+
+
+def current_access(path: str, name: str) -> None:
+    """The access command as it runs now, a single get_random_quote."""
+    database.get_random_quote(GUILD_ID, name)
+
+
+def benchmark(access, path: str, names: list, runs: int) -> list:
+    """
+    Returns:
+        list: Microseconds each access took
+    """
+    timings = []
+    for _ in range(runs):
+        name = random.choice(names)
+        started = time.perf_counter()
+        access(path, name)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare pooled connections with connecting on every call"
+    )
+    parser.add_argument("--names", type=int, default=1000, help="Names to create")
+    parser.add_argument(
+        "--quotes", type=int, default=10, help="Quotes to create per name"
+    )
+    parser.add_argument("--runs", type=int, default=5000, help="Accesses per mode")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    if args.runs < 2:
+        parser.error("--runs must be at least 2")
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.configure(directory)
+        names = [f"name{i}" for i in range(args.names)]
+        database.import_quotes(
+            GUILD_ID,
+            (
+                (name, f"quote {i} of {name}")
+                for name in names
+                for i in range(args.quotes)
+            ),
+        )
+        path = database.get_guild(GUILD_ID).path
+        print(f"names={args.names} quotes={args.names * args.quotes} runs={args.runs}")
+        results = {}
+        for mode, access in (
+            ("reconnect", reconnect_access),
+            ("pooled", pooled_access),
+            ("current", current_access),
+        ):
+            # One untimed access opens the pool and warms the page cache
+            access(path, names[0])
+            timings = benchmark(access, path, names, args.runs)
+            percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+            results[mode] = statistics.mean(timings)
+            print(
+                f"{mode:<9}  p50 {percentiles[49]:.0f}us  p99 {percentiles[98]:.0f}us"
+                f"  mean {results[mode]:.0f}us"
+            )
+        database.close_pools()
+    print(
+        f"pooled is {results['reconnect'] / results['pooled']:.1f}x and current "
+        f"{results['reconnect'] / results['current']:.1f}x faster than reconnect"
+    )
+
+
+if __name__ == "__main__":
+    main()
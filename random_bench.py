@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import logging
+import random
+import statistics
+import tempfile
+import time
+
+import database
+
+GUILD_ID = 1
+
+
+def old_random_name(path: str) -> str:
+    """get_random_name before the quote index, the whole people table."""
+    with database.OpenDatabase(path) as cursor:
+        cursor.execute("SELECT name FROM people")
+        return random.choice([v[0] for v in cursor.fetchall()])
+
+
+def old_random_quote(path: str, name: str) -> str:
+    """get_random_quote before the quote index, sorting every quote of name."""
+    with database.OpenDatabase(path) as cursor:
+        cursor.execute(
+            "SELECT quote FROM quotes WHERE name=? ORDER BY RANDOM() LIMIT 1", (name,)
+        )
+        return cursor.fetchone()[0]
+
+
+def benchmark(pick, runs: int) -> list:
+    """
+    Returns:
+        list: Microseconds each pick took
+    """
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        pick()
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def rows(names: list, quotes: int, heavy: float):
+    """
+    Yield quotes spread evenly over names, except for a heavy share that all
+    goes to the first name.
+    """
+    for name in names:
+        yield name, None
+    for i in range(quotes):
+        if i < quotes * heavy:
+            name = names[0]
+        else:
+            name = names[i % len(names)]
+        yield name, f"quote {i} of {name}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare random name and quote picks from the quote index "
+        "with the SQL queries they replaced"
+    )
+    parser.add_argument("--names", type=int, default=10_000, help="Names to create")
+    parser.add_argument(
+        "--quotes", type=int, default=1_000_000, help="Quotes to create in total"
+    )
+    parser.add_argument(
+        "--heavy",
+        type=float,
+        default=0.1,
+        help="Share of the quotes that belong to a single name",
+    )
+    parser.add_argument("--runs", type=int, default=2000, help="Picks per mode")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    if args.runs < 2:
+        parser.error("--runs must be at least 2")
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.configure(directory)
+        names = [f"name{i}" for i in range(args.names)]
+        started = time.perf_counter()
+        database.import_quotes(GUILD_ID, rows(names, args.quotes, args.heavy))
+        path = database.get_guild(GUILD_ID).path
+        print(
+            f"names={args.names} quotes={args.quotes} heavy={args.heavy} "
+            f"runs={args.runs}, imported in {time.perf_counter() - started:.1f}s"
+        )
+
+        heavy = names[0]
+        modes = (
+            ("old name", lambda: old_random_name(path)),
+            ("name", lambda: database.get_random_name(GUILD_ID)),
+            ("weighted name", lambda: database.get_random_name(GUILD_ID, True)),
+            ("old quote", lambda: old_random_quote(path, random.choice(names))),
+            (
+                "quote",
+                lambda: database.get_random_quote(GUILD_ID, random.choice(names)),
+            ),
+            ("old heavy quote", lambda: old_random_quote(path, heavy)),
+            ("heavy quote", lambda: database.get_random_quote(GUILD_ID, heavy)),
+            (
+                "heavy quote bag",
+                lambda: database.get_random_quote(GUILD_ID, heavy, channel_id=1),
+            ),
+        )
+        for mode, pick in modes:
+            # One untimed pick warms the page cache
+            pick()
+            timings = benchmark(pick, args.runs)
+            percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+            print(
+                f"{mode:<15}  p50 {percentiles[49]:.0f}us  "
+                f"p99 {percentiles[98]:.0f}us  max {max(timings):.0f}us"
+            )
+        database.close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import collections
+import logging
+import time
+
+from disnake.ext import commands
+
+import metrics
+
+module_logger = logging.getLogger(f"__main__.{__name__}")
+
+SCOPES = ("user", "channel", "guild")
+
+
+class RateLimited(commands.CheckFailure):
+    """
+    Raised by the rate limit check when a command is used too often.
+
+    Args:
+        command (str): Command that was limited
+        retry_after (float): Seconds until the command can be used again
+    """
+
+    def __init__(self, command: str, retry_after: float):
+        super().__init__(f"{command} is rate limited for {retry_after:.1f}s")
+        self.command = command
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token buckets for one limit, one bucket per key. A bucket holds up to
+    rate tokens and refills at rate tokens every per seconds, each use takes
+    a token. Buckets are kept in least recently used order so the ones that
+    have refilled completely are dropped from the front as they expire, a
+    full bucket is the same as no bucket.
+
+    Args:
+        rate (int): Uses allowed in a burst
+        per (float): Seconds to refill from empty
+    """
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._buckets = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _expire(self, now: float) -> None:
+        while self._buckets:
+            _, updated = next(iter(self._buckets.values()))
+            if updated + self.per > now:
+                break
+            self._buckets.popitem(last=False)
+
+    def _tokens(self, key, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.rate, now))
+        return min(self.rate, tokens + (now - updated) * self.rate / self.per)
+
+    def retry_after(self, key, now: float) -> float:
+        """
+        Returns:
+            float: Seconds until key has a token, 0 if it has one now
+        """
+        self._expire(now)
+        tokens = self._tokens(key, now)
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) * self.per / self.rate
+
+    def consume(self, key, now: float) -> None:
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+        self._buckets.move_to_end(key)
+
+
+def scope_key(source, scope: str) -> int:
+    """
+    Returns the id a scope limits by for a ctx or inter, direct messages
+    count as their own guild.
+    """
+    if scope == "user":
+        return source.author.id
+    if scope == "guild" and source.guild is not None:
+        return source.guild.id
+    return source.channel.id
+
+
+class RateLimits:
+    """
+    Per command rate limits for any mix of the user, channel and guild scopes.
+    A use is only counted when every scope of the command allows it.
+
+    Args:
+        limits (dict): "rate/seconds" strings keyed by "command.scope", like
+            {"status.user": "3/30"}. Command names ignore dashes so the
+            message and slash versions of a command share their limits.
+    Raises:
+        ValueError: A limit is malformed or uses an unknown scope
+    """
+
+    def __init__(self, limits: dict):
+        self.buckets = {}
+        for key, value in limits.items():
+            command, _, scope = key.rpartition(".")
+            if scope not in SCOPES or not command:
+                raise ValueError(f"Unknown rate limit {key}, use command.{SCOPES}")
+            rate, _, per = value.partition("/")
+            self.buckets.setdefault(self.normalize(command), []).append(
+                (scope, TokenBucket(int(rate), float(per)))
+            )
+
+    @staticmethod
+    def normalize(command: str) -> str:
+        return command.replace("-", "").lower()
+
+    def hit(self, command: str, source) -> float:
+        """
+        Count a use of a command if it is allowed.
+
+        Args:
+            command (str): Qualified command name
+            source: ctx or inter that used the command
+        Returns:
+            float: 0 if the use was counted, otherwise seconds until it would be
+        """
+        limits = self.buckets.get(self.normalize(command))
+        if not limits:
+            return 0.0
+        now = time.monotonic()
+        keys = [(bucket, scope_key(source, scope)) for scope, bucket in limits]
+        retry_after = max(bucket.retry_after(key, now) for bucket, key in keys)
+        if retry_after > 0:
+            metrics.increment("rate_limited_total", command=command)
+            module_logger.debug(
+                f"{command} by {source.author.id} limited for {retry_after:.1f}s"
+            )
+            return retry_after
+        for bucket, key in keys:
+            bucket.consume(key, now)
+        return 0.0
+
+    def check(self, command: str, source) -> bool:
+        """
+        Command check that raises RateLimited instead of returning False so
+        the error handler can tell the user how long to wait.
+        """
+        if retry_after := self.hit(command, source):
+            raise RateLimited(command, retry_after)
+        return True
@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import importlib.abc
+import os
+import sys
+import time
+
+# Imported first by bot.py, so this is as close to process start as we get
+started = time.perf_counter()
+
+# Read straight from the environment since the imports are timed before
+# Config has loaded .env
+profiling = os.environ.get("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+
+stages = []
+import_times = {}
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module's loader to time how long executing the module takes."""
+
+    def __init__(self, loader: importlib.abc.Loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        began = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            import_times[self._name] = time.perf_counter() - began
+
+    def __getattr__(self, name: str):
+        return getattr(self._loader, name)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Finder placed in front of sys.meta_path that lets the regular finders
+    locate each module and wraps the loader they return with a timer. Times
+    include the imports a module makes itself, like python -X importtime's
+    cumulative column.
+    """
+
+    def find_spec(self, fullname: str, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, fullname)
+        return spec
+
+
+def record(stage: str, seconds: float) -> None:
+    """Add a timed startup stage, like loading a cog, to the report."""
+    stages.append((stage, seconds))
+
+
+def report(limit: int = 15) -> str:
+    """
+    Returns:
+        str: Startup stages in order followed by the slowest imports
+    """
+    lines = ["Startup profile:"]
+    lines += [f"  {stage}: {seconds * 1000:.1f} ms" for stage, seconds in stages]
+    if import_times:
+        lines.append(f"Slowest of {len(import_times)} imports (cumulative):")
+        slowest = sorted(import_times.items(), key=lambda item: item[1], reverse=True)
+        lines += [
+            f"  {name}: {seconds * 1000:.1f} ms" for name, seconds in slowest[:limit]
+        ]
+    return "\n".join(lines)
+
+
+if profiling:
+    sys.meta_path.insert(0, ImportTimer())
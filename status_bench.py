@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# SPDX-FileCopyrightText: 2024 Kevin Patino
+# SPDX-License-Identifier: MIT
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import statistics
+import time
+
+from cogs import status as status_cog
+from config import Config
+
+STATUS = {
+    "version": {"name": "Paper 1.21.4", "protocol": 769},
+    "players": {
+        "online": 2,
+        "max": 20,
+        "sample": [
+            {"name": "Alex", "id": "00000000-0000-0000-0000-000000000001"},
+            {"name": "Steve", "id": "00000000-0000-0000-0000-000000000002"},
+        ],
+    },
+    "description": {"text": "A fake Minecraft server"},
+}
+QUERY = {
+    "hostname": "A fake Minecraft server",
+    "gametype": "SMP",
+    "game_id": "MINECRAFT",
+    "version": "1.21.4",
+    "plugins": "Paper on 1.21.4",
+    "map": "world",
+    "numplayers": "2",
+    "maxplayers": "20",
+    "hostport": "25565",
+    "hostip": "127.0.0.1",
+}
+QUERY_PLAYERS = ("Alex", "Steve")
+QUERY_CHALLENGE = b"9513307"
+
+
+def varint(value: int) -> bytes:
+    data = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if not value:
+            data.append(byte)
+            return bytes(data)
+        data.append(byte | 0x80)
+
+
+async def read_varint(reader: asyncio.StreamReader) -> int:
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+    raise ValueError("VarInt is too big")
+
+
+class FakeJavaServer:
+    """
+    Answers the Java server list ping over TCP and, depending on query, the
+    GameSpy4 query over UDP on the same port. Every response is sent after
+    delay seconds to stand in for the network round trip.
+
+    Args:
+        delay (float): Seconds to wait before each response
+        query (str): "answer" replies to queries, "drop" ignores them like a
+            firewalled server and "closed" doesn't listen for them at all
+    """
+
+    def __init__(self, delay: float, query: str):
+        self.delay = delay
+        self.query = query
+        self.server = None
+        self.transport = None
+
+    async def start(self) -> str:
+        """
+        Returns:
+            str: Address the server listens on
+        """
+        self.server = await asyncio.start_server(self.handle_java, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        if self.query != "closed":
+            loop = asyncio.get_running_loop()
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: FakeQueryProtocol(self), local_addr=("127.0.0.1", port)
+            )
+        return f"127.0.0.1:{port}"
+
+    def close(self) -> None:
+        self.server.close()
+        if self.transport is not None:
+            self.transport.close()
+
+    async def handle_java(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                data = await reader.readexactly(await read_varint(reader))
+                # The handshake is also packet 0 but, unlike the status
+                # request, has a body and gets no response
+                if data == b"\x00":
+                    body = json.dumps(STATUS).encode()
+                    response = b"\x00" + varint(len(body)) + body
+                elif data[0] == 1:
+                    # Ping, echoed back with its token
+                    response = data
+                else:
+                    continue
+                await asyncio.sleep(self.delay)
+                writer.write(varint(len(response)) + response)
+                await writer.drain()
+        except asyncio.IncompleteReadError, ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class FakeQueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: FakeJavaServer):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple) -> None:
+        if self.server.query == "drop" or data[:2] != b"\xfe\xfd":
+            return
+        packet_type, session = data[2], data[3:7]
+        if packet_type == 9:
+            response = b"\x09" + session + QUERY_CHALLENGE + b"\x00"
+        elif packet_type == 0:
+            response = (
+                b"\x00"
+                + session
+                + b"splitnum\x00\x80\x00"
+                + b"".join(
+                    f"{key}\x00{value}\x00".encode() for key, value in QUERY.items()
+                )
+                + b"\x00\x01player_\x00\x00"
+                + b"".join(f"{player}\x00".encode() for player in QUERY_PLAYERS)
+                + b"\x00"
+            )
+        else:
+            return
+        asyncio.get_running_loop().call_later(
+            self.server.delay, self.transport.sendto, response, address
+        )
+
+
+async def benchmark(address: str, runs: int) -> tuple[list, collections.Counter]:
+    """
+    Call status() against address runs times one after another.
+
+    Returns:
+        tuple: Milliseconds each call took and how often each response won
+    """
+    timings = []
+    winners = collections.Counter()
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = await status_cog.status(address)
+        timings.append((time.perf_counter() - started) * 1000)
+        winners[type(response).__name__] += 1
+    return timings, winners
+
+
+async def run(args: argparse.Namespace) -> None:
+    server = FakeJavaServer(args.delay / 1000, args.query)
+    address = await server.start()
+    try:
+        # Leave the lookup out of the timings, the bot caches it as well
+        await status_cog.lookup(address)
+        timings, winners = await benchmark(address, args.runs)
+    finally:
+        server.close()
+    percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+    print(
+        f"query={args.query} delay={args.delay}ms "
+        f"preference={Config.status_query_preference}ms runs={args.runs}"
+    )
+    print(
+        f"p50 {percentiles[49]:.1f}ms  p99 {percentiles[98]:.1f}ms  "
+        f"max {max(timings):.1f}ms"
+    )
+    print(", ".join(f"{name} won {count}" for name, count in winners.most_common()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure /status latency against a fake local Minecraft server"
+    )
+    parser.add_argument(
+        "--query",
+        choices=("answer", "drop", "closed"),
+        default="drop",
+        help="How the fake server treats queries, drop acts like enable-query=false "
+        "behind a firewall",
+    )
+    parser.add_argument(
+        "--delay", type=float, default=0, help="Milliseconds before each response"
+    )
+    parser.add_argument("--runs", type=int, default=100, help="Calls to status()")
+    parser.add_argument(
+        "--preference",
+        type=int,
+        default=Config.status_query_preference,
+        help="Milliseconds a status waits for the query, defaults to "
+        "STATUS_QUERY_PREFERENCE_MS",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Log the timing of every stage"
+    )
+    args = parser.parse_args()
+    if args.runs < 2:
+        parser.error("--runs must be at least 2")
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.CRITICAL,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    Config.status_query_preference = args.preference
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()